@@ -0,0 +1,36 @@
+import os
+
+########################################
+# Режим работы сервера: threading (по умолчанию, dev-сервер Flask),
+# eventlet или gevent (ASYNC_MODE=...). В асинхронных режимах тысячи
+# websocket-соединений обслуживаются гринлетами одного процесса, поэтому
+# всё, что блокирует (SQLite, сжатие, PIL, ffmpeg), выполняется через
+# run_blocking() в пуле настоящих потоков ОС, а не в цикле событий.
+# patch() нужно вызвать до импорта остальных модулей сервера.
+########################################
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'threading')
+
+if ASYNC_MODE not in ('threading', 'eventlet', 'gevent'):
+    raise ValueError(f"Неизвестный ASYNC_MODE: {ASYNC_MODE}")
+
+def patch():
+    if ASYNC_MODE == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    elif ASYNC_MODE == 'gevent':
+        from gevent import monkey
+        monkey.patch_all()
+
+def is_async() -> bool:
+    return ASYNC_MODE != 'threading'
+
+def run_blocking(func, *args, **kwargs):
+    # В режиме threading обработчик и так в своём потоке - вызываем напрямую.
+    # Внутри func нельзя снова вызывать run_blocking.
+    if ASYNC_MODE == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    if ASYNC_MODE == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+    return func(*args, **kwargs)
@@ -0,0 +1,388 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import time
+import tracemalloc
+
+import compression
+
+try:
+    import pytest
+except ImportError:  # pytest нужен только для запуска через pytest-benchmark
+    pytest = None
+
+########################################
+# Бенчмарк загрузки истории чата: сколько стоит decompress()
+# одного сообщения размером от 1 КБ до 64 КБ
+########################################
+
+WORDS = [
+    "привет", "как", "дела", "сегодня", "завтра", "встреча", "файл", "сжатие",
+    "hello", "ok", "thanks", "see", "you", "later", "log", "error", "line",
+    "12:30", "2024-05-01", "traceback", "server", "room", "message", ":)",
+]
+
+def make_chat_text(size: int, seed: int = 0) -> bytes:
+    # Синтетический текст чата: слова из словаря, знаки препинания и переводы строк
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        sep = rng.choice([" ", " ", " ", ", ", ". ", "\n"])
+        chunk = (word + sep).encode('utf-8')
+        parts.append(chunk)
+        length += len(chunk)
+    return b"".join(parts)[:size]
+
+def make_log_text(size: int, seed: int = 0) -> bytes:
+    # Вставленный в чат лог: почти одинаковые строки с разными временем и числами
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        line = (f"2024-05-01 12:{rng.randrange(60):02d}:{rng.randrange(60):02d} "
+                f"INFO server: room {rng.randrange(10)} message {rng.randrange(1000)} sent\n").encode('utf-8')
+        parts.append(line)
+        length += len(line)
+    return b"".join(parts)[:size]
+
+def make_random_bytes(size: int, seed: int = 0) -> bytes:
+    return random.Random(seed).randbytes(size)
+
+DATA_KINDS = {
+    "chat": make_chat_text,
+    "log": make_log_text,
+    "random": make_random_bytes,
+}
+
+def time_call(func, *args, repeat: int = 3) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def bench_history_load(sizes_kb, repeat: int = 3):
+    results = []
+    for size_kb in sizes_kb:
+        data = make_chat_text(size_kb * 1024, seed=size_kb)
+        compressed = compression.compress(data, use_bwt=True)
+        assert compression.decompress(compressed) == data
+        compress_time = time_call(compression.compress, data, True, repeat=repeat)
+        decompress_time = time_call(compression.decompress, compressed, repeat=repeat)
+        results.append({
+            "size_kb": size_kb,
+            "compressed_size": len(compressed),
+            "compress_ms": compress_time * 1000,
+            "decompress_ms": decompress_time * 1000,
+        })
+    return results
+
+########################################
+# Стадия Хаффмана отдельно: табличный compression.huffman_decode против
+# исходного декодера (распаковка в строку '0'/'1' и обход дерева по битам)
+# на выходе BWT+MTF+RLE настоящих данных; таблицы каждый раз строятся заново,
+# как у сообщения с собственной таблицей.
+########################################
+def reference_huffman_decode(packed: bytes, codes: dict) -> list[int]:
+    tree = compression.HuffmanNode(None, 0)
+    for symbol, (code, length) in codes.items():
+        node = tree
+        for bit in format(code, f'0{length}b'):
+            side = 'left' if bit == '0' else 'right'
+            if getattr(node, side) is None:
+                setattr(node, side, compression.HuffmanNode(None, 0))
+            node = getattr(node, side)
+        node.symbol = symbol
+    bits = ""
+    for byte in packed[1:]:
+        bits += format(byte, '08b')
+    if packed[0]:
+        bits = bits[:-packed[0]]
+    output = []
+    node = tree
+    for bit in bits:
+        node = node.left if bit == '0' else node.right
+        if node.left is None and node.right is None:
+            output.append(node.symbol)
+            node = tree
+    return output
+
+def bench_huffman(sizes, repeat: int = 7):
+    results = []
+    for kind, generator in DATA_KINDS.items():
+        for size in sizes:
+            data = generator(size, seed=size)
+            symbols = compression.rle_encode(compression.mtf_encode(compression.bwt_transform(data)[0]))
+            packed, freq = compression.huffman_encode(symbols)
+            codes = compression.huffman_code_table(
+                compression.generate_huffman_codes(compression.build_huffman_tree(freq)))
+            assert reference_huffman_decode(packed, codes) == symbols
+            assert compression.huffman_decode(packed, codes) == symbols
+            def decode_fresh():
+                compression.cached_decode_tables.cache_clear()
+                compression.huffman_decode(packed, codes)
+            results.append({
+                "kind": kind,
+                "size": size,
+                "reference_ms": time_call(reference_huffman_decode, packed, codes, repeat=repeat) * 1000,
+                "table_ms": time_call(decode_fresh, repeat=repeat) * 1000,
+                "cached_ms": time_call(compression.huffman_decode, packed, codes, repeat=repeat) * 1000,
+            })
+    return results
+
+def bench_codecs(sizes, repeat: int = 3):
+    # Размер кадра и время каждого кодека на разных данных -
+    # по этой таблице подобраны пороги compression.choose_codec
+    results = []
+    for kind, generator in DATA_KINDS.items():
+        for size in sizes:
+            data = generator(size, seed=size)
+            for codec in compression.available_codecs():
+                compressed = compression.compress(data, codec=codec)
+                assert compression.decompress(compressed) == data
+                results.append({
+                    "kind": kind,
+                    "size": size,
+                    "codec": codec,
+                    "compressed_size": len(compressed),
+                    "compress_ms": time_call(lambda: compression.compress(data, codec=codec), repeat=repeat) * 1000,
+                    "decompress_ms": time_call(compression.decompress, compressed, repeat=repeat) * 1000,
+                    "auto": compression.choose_codec(data),
+                })
+    return results
+
+########################################
+# Полный прогон: каждый путь кодека на каждом корпусе, по корзинам размеров.
+# Для каждой тройки (путь, корпус, корзина) считаются MB/s, степень сжатия,
+# пиковая память (tracemalloc) и p50/p99 задержки; результат пишется в JSON
+# и сравнивается с прошлым прогоном через --compare.
+########################################
+UPLOADS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'compressed_uploads')
+
+SIZE_BUCKETS = [
+    ("<64B", 0, 64),
+    ("64B-1KB", 64, 1024),
+    ("1-16KB", 1024, 16 * 1024),
+    ("16-256KB", 16 * 1024, 256 * 1024),
+    (">=256KB", 256 * 1024, None),
+]
+
+def size_bucket(size: int) -> str:
+    for name, low, high in SIZE_BUCKETS:
+        if size >= low and (high is None or size < high):
+            return name
+
+def codec_paths() -> dict:
+    # Старые форматы 0x00/0x01 пишутся напрямую, остальные - через compress()
+    paths = {
+        "0x00 large v1": lambda data: bytes([compression.FLAG_LARGE]) + compression.compress_large(data),
+        "0x01 bwt v1": lambda data: bytes([compression.FLAG_SMALL]) + compression.compress_small(data),
+    }
+    for codec in compression.available_codecs() + ('auto',):
+        paths[codec] = lambda data, codec=codec: compression.compress(data, codec=codec)
+    return paths
+
+def chat_corpus(count: int = 60, seed: int = 0) -> list[bytes]:
+    # Длины сообщений распределены логнормально: много коротких, изредка простыни
+    rng = random.Random(seed)
+    sizes = [min(int(rng.lognormvariate(4.5, 1.5)) + 1, 256 * 1024) for _ in range(count)]
+    return [make_chat_text(size, seed=i) for i, size in enumerate(sizes)]
+
+def uploads_corpus(max_size: int) -> list[bytes]:
+    samples = []
+    if os.path.isdir(UPLOADS_DIR):
+        for name in sorted(os.listdir(UPLOADS_DIR)):
+            with open(os.path.join(UPLOADS_DIR, name), 'rb') as f:
+                samples.append(f.read(max_size))
+    return samples
+
+def build_corpora(max_size: int) -> dict:
+    sizes = sorted({min(size, max_size) for size in (16, 200, 4 * 1024, 64 * 1024, max_size)})
+    return {
+        "chat": chat_corpus(),
+        "log": [make_log_text(size, seed=size) for size in sizes],
+        "random": [make_random_bytes(size, seed=size) for size in sizes],
+        "uploads": uploads_corpus(max_size),
+    }
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p * len(ordered)) - 1)]
+
+def peak_memory(func, data) -> int:
+    tracemalloc.start()
+    try:
+        func(data)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_suite(max_size: int = 256 * 1024, repeat: int = 3, paths: list = None) -> dict:
+    corpora = build_corpora(max_size)
+    all_paths = codec_paths()
+    results = []
+    for path_name, compress_func in all_paths.items():
+        if paths and path_name not in paths:
+            continue
+        for corpus_name, samples in corpora.items():
+            buckets = {}
+            for data in samples:
+                buckets.setdefault(size_bucket(len(data)), []).append(data)
+            for bucket, bucket_samples in buckets.items():
+                compress_times = []
+                decompress_times = []
+                input_bytes = 0
+                output_bytes = 0
+                for data in bucket_samples:
+                    frame = compress_func(data)
+                    assert compression.decompress(frame) == data, (path_name, corpus_name, len(data))
+                    input_bytes += len(data)
+                    output_bytes += len(frame)
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        compress_func(data)
+                        compress_times.append(time.perf_counter() - start)
+                        start = time.perf_counter()
+                        compression.decompress(frame)
+                        decompress_times.append(time.perf_counter() - start)
+                largest = max(bucket_samples, key=len)
+                largest_frame = compress_func(largest)
+                results.append({
+                    "path": path_name,
+                    "corpus": corpus_name,
+                    "bucket": bucket,
+                    "samples": len(bucket_samples),
+                    "input_bytes": input_bytes,
+                    "compressed_bytes": output_bytes,
+                    "ratio": input_bytes / output_bytes if output_bytes else 0.0,
+                    "compress_mb_s": input_bytes * repeat / sum(compress_times) / 1e6,
+                    "decompress_mb_s": input_bytes * repeat / sum(decompress_times) / 1e6,
+                    "compress_p50_ms": percentile(compress_times, 0.50) * 1000,
+                    "compress_p99_ms": percentile(compress_times, 0.99) * 1000,
+                    "decompress_p50_ms": percentile(decompress_times, 0.50) * 1000,
+                    "decompress_p99_ms": percentile(decompress_times, 0.99) * 1000,
+                    "compress_peak_kb": peak_memory(compress_func, largest) / 1024,
+                    "decompress_peak_kb": peak_memory(compression.decompress, largest_frame) / 1024,
+                })
+    return {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "codecs": list(compression.available_codecs()),
+            "numpy": compression.np is not None,
+            "max_size": max_size,
+            "repeat": repeat,
+        },
+        "results": results,
+    }
+
+def print_suite(report: dict):
+    print(f"{'Путь':>14} {'Корпус':>8} {'Корзина':>9} {'Сжатие':>7} {'comp MB/s':>10} {'dec MB/s':>10} "
+          f"{'comp p50/p99, мс':>18} {'dec p50/p99, мс':>18} {'пик, КБ':>9}")
+    for row in report["results"]:
+        print(f"{row['path']:>14} {row['corpus']:>8} {row['bucket']:>9} {row['ratio']:>7.2f} "
+              f"{row['compress_mb_s']:>10.2f} {row['decompress_mb_s']:>10.2f} "
+              f"{row['compress_p50_ms']:>8.2f}/{row['compress_p99_ms']:<9.2f} "
+              f"{row['decompress_p50_ms']:>8.2f}/{row['decompress_p99_ms']:<9.2f} "
+              f"{max(row['compress_peak_kb'], row['decompress_peak_kb']):>9.0f}")
+
+def compare_reports(baseline: dict, current: dict, threshold: float = 0.10) -> list:
+    # Регрессия - падение скорости или степени сжатия больше threshold
+    old_rows = {(r["path"], r["corpus"], r["bucket"]): r for r in baseline["results"]}
+    regressions = []
+    for row in current["results"]:
+        old = old_rows.get((row["path"], row["corpus"], row["bucket"]))
+        if old is None:
+            continue
+        for metric in ("ratio", "compress_mb_s", "decompress_mb_s"):
+            if old[metric] and row[metric] < old[metric] * (1 - threshold):
+                regressions.append((row["path"], row["corpus"], row["bucket"], metric, old[metric], row[metric]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк compression.py")
+    parser.add_argument("--sizes", help="Размеры через запятую: в КБ для истории, в байтах для --codecs")
+    parser.add_argument("--repeat", type=int, default=3, help="Число повторов (берётся лучшее время)")
+    parser.add_argument("--codecs", action="store_true", help="Сравнить кодеки (размеры в байтах)")
+    parser.add_argument("--huffman", action="store_true", help="Стадия Хаффмана против исходного декодера (размеры в байтах)")
+    parser.add_argument("--suite", action="store_true", help="Полный прогон всех путей кодеков по корпусам")
+    parser.add_argument("--max-size", type=int, default=256 * 1024, help="Максимальный размер образца для --suite")
+    parser.add_argument("--paths", help="Только эти пути кодеков (через запятую) для --suite")
+    parser.add_argument("--json", help="Сохранить результаты --suite в JSON")
+    parser.add_argument("--compare", help="Сравнить с сохранённым JSON и вывести регрессии")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Допустимое падение метрики для --compare")
+    args = parser.parse_args()
+
+    if args.suite:
+        paths = args.paths.split(",") if args.paths else None
+        report = bench_suite(max_size=args.max_size, repeat=args.repeat, paths=paths)
+        print_suite(report)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"Результаты сохранены: {args.json}")
+        if args.compare:
+            with open(args.compare, encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = compare_reports(baseline, report, args.threshold)
+            for path, corpus, bucket, metric, old, new in regressions:
+                print(f"РЕГРЕССИЯ {path}/{corpus}/{bucket}: {metric} {old:.2f} -> {new:.2f}")
+            if regressions:
+                raise SystemExit(1)
+            print("Регрессий нет")
+        return
+
+    if args.huffman:
+        sizes = [int(s) for s in (args.sizes or "512,2048,16384,65536").split(",") if s]
+        print(f"{'Данные':>8} {'Размер':>8} {'исходный, мс':>14} {'таблицы, мс':>13} {'из кэша, мс':>13} {'ускорение':>10}")
+        for row in bench_huffman(sizes, repeat=max(args.repeat, 7)):
+            print(f"{row['kind']:>8} {row['size']:>8} {row['reference_ms']:>14.3f} {row['table_ms']:>13.3f} "
+                  f"{row['cached_ms']:>13.3f} {row['reference_ms'] / row['table_ms']:>9.2f}x")
+        return
+
+    if args.codecs:
+        sizes = [int(s) for s in (args.sizes or "16,48,256,1024,4096,16384,65536").split(",") if s]
+        print(f"{'Данные':>8} {'Размер':>8} {'Кодек':>8} {'Сжато':>8} {'compress, мс':>14} {'decompress, мс':>16} {'auto':>8}")
+        for row in bench_codecs(sizes, repeat=args.repeat):
+            print(f"{row['kind']:>8} {row['size']:>8} {row['codec']:>8} {row['compressed_size']:>8} "
+                  f"{row['compress_ms']:>14.2f} {row['decompress_ms']:>16.2f} {row['auto']:>8}")
+        return
+
+    sizes = [int(s) for s in (args.sizes or "1,4,16,64").split(",") if s]
+    print(f"{'Размер':>8} {'Сжато':>10} {'compress, мс':>14} {'decompress, мс':>16}")
+    for row in bench_history_load(sizes, repeat=args.repeat):
+        print(f"{row['size_kb']:>6}КБ {row['compressed_size']:>10} "
+              f"{row['compress_ms']:>14.1f} {row['decompress_ms']:>16.1f}")
+
+########################################
+# Совместимость с pytest-benchmark:
+#   pytest bench_compression.py --benchmark-only
+########################################
+if pytest is not None:
+    BENCH_SIZES = [64, 4 * 1024, 64 * 1024]
+
+    @pytest.mark.parametrize("size", BENCH_SIZES)
+    @pytest.mark.parametrize("path", list(codec_paths()))
+    def test_compress(benchmark, path, size):
+        data = make_chat_text(size, seed=size)
+        frame = benchmark(codec_paths()[path], data)
+        assert compression.decompress(frame) == data
+
+    @pytest.mark.parametrize("size", BENCH_SIZES)
+    @pytest.mark.parametrize("path", list(codec_paths()))
+    def test_decompress(benchmark, path, size):
+        data = make_chat_text(size, seed=size)
+        frame = codec_paths()[path](data)
+        assert benchmark(compression.decompress, frame) == data
+
+if __name__ == '__main__':
+    main()
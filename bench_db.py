@@ -0,0 +1,114 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import compression
+from bench_compression import make_chat_text
+from db_pool import ConnectionPool
+from message_writer import MessageWriter
+
+########################################
+# Пропускная способность вставки сообщений в private_messages:
+# "до" - новое соединение на каждое сообщение в режиме rollback journal
+# (как get_db_connection() раньше), "после" - пул соединений с WAL
+# и групповой commit через MessageWriter (одна транзакция на пачку).
+# Каждый режим пишет в свою временную базу, рабочая database.db не трогается.
+# "До" всегда идёт с synchronous=FULL - умолчанием SQLite, которое старый
+# get_db_connection() не менял; --sync задаёт режим только для "после",
+# и режим каждой строки печатается рядом с результатом.
+########################################
+BASELINE_SYNC = 'FULL'
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS private_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender TEXT,
+        receiver TEXT,
+        conversation_id TEXT,
+        timestamp REAL,
+        compressed_message BLOB
+    )
+'''
+
+def make_frames(count: int) -> list[bytes]:
+    return [compression.compress(make_chat_text(200, seed=i), codec='auto') for i in range(count)]
+
+INSERT_SQL = ("INSERT INTO private_messages (sender, receiver, conversation_id, timestamp, compressed_message) "
+              "VALUES (?, ?, ?, ?, ?)")
+
+def message_params(frame: bytes) -> tuple:
+    return ('alice', 'bob', '5:alicebob', time.time(), frame)
+
+def insert_message(conn, frame: bytes):
+    conn.execute(INSERT_SQL, message_params(frame))
+    conn.commit()
+
+def connect_per_message(database: str):
+    def get_connection():
+        return sqlite3.connect(database)
+    return get_connection
+
+def run_inserts(get_connection, frames: list[bytes], threads: int, sync: str, writer: MessageWriter = None) -> float:
+    # Сообщения делятся между потоками, как между обработчиками Socket.IO;
+    # с writer каждый поток ждёт подтверждения commit, как обработчик сообщения
+    def worker(part):
+        for frame in part:
+            if writer is not None:
+                writer.write(message_params(frame))
+                continue
+            conn = get_connection()
+            conn.execute(f"PRAGMA synchronous={sync}")
+            insert_message(conn, frame)
+            conn.close()
+
+    parts = [frames[i::threads] for i in range(threads)]
+    workers = [threading.Thread(target=worker, args=(part,)) for part in parts]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return time.perf_counter() - start
+
+def bench_inserts(count: int, threads: int, sync: str = 'FULL', batch_rows: int = 100, flush_ms: float = 0):
+    frames = make_frames(count)
+    with tempfile.TemporaryDirectory() as tmp:
+        databases = [os.path.join(tmp, f'{name}.db') for name in ('before', 'pool', 'writer')]
+        for database in databases:
+            conn = sqlite3.connect(database)
+            conn.execute(SCHEMA)
+            conn.close()
+
+        before = run_inserts(connect_per_message(databases[0]), frames, threads, BASELINE_SYNC)
+        pool = ConnectionPool(databases[1])
+        after = run_inserts(pool.get, frames, threads, sync)
+        pool.close_all()
+        pool = ConnectionPool(databases[2])
+        writer = MessageWriter(pool.get, INSERT_SQL, batch_rows=batch_rows, flush_ms=flush_ms, sync=sync)
+        grouped = run_inserts(pool.get, frames, threads, sync, writer)
+        writer.close()
+        pool.close_all()
+
+    print(f"Сообщений: {count}, потоков: {threads}")
+    print(f"{'Режим':>28} {'synchronous':>12} {'Время, с':>10} {'Сообщ./с':>10}")
+    print(f"{'connect() + rollback journal':>28} {BASELINE_SYNC:>12} {before:>10.3f} {count / before:>10.0f}")
+    print(f"{'пул + WAL':>28} {sync:>12} {after:>10.3f} {count / after:>10.0f}")
+    print(f"{'пул + WAL + пачки':>28} {sync:>12} {grouped:>10.3f} {count / grouped:>10.0f}")
+    print(f"Пачек: {writer.stats['batches']}, в среднем строк: {writer.stats['rows'] / writer.stats['batches']:.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк вставки сообщений в SQLite")
+    parser.add_argument("--count", type=int, default=2000, help="Сколько сообщений вставить")
+    parser.add_argument("--threads", type=int, default=1, help="Сколько потоков пишут одновременно")
+    parser.add_argument("--sync", default="FULL", choices=["FULL", "NORMAL", "OFF"],
+                        help="PRAGMA synchronous для пула и пачек (\"до\" всегда FULL)")
+    parser.add_argument("--batch-rows", type=int, default=100, help="Максимум строк в пачке")
+    parser.add_argument("--flush-ms", type=float, default=0, help="Ожидание добора пачки, мс")
+    args = parser.parse_args()
+    bench_inserts(args.count, args.threads, args.sync, args.batch_rows, args.flush_ms)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+import socketio
+
+########################################
+# Нагрузочный тест чата: N клиентов регистрируются, держат websocket-
+# соединения, разбиваются на пары и шлют друг другу сообщения.
+# Задержка - от emit('send_private_message') до receive_private_message
+# у самого отправителя (он тоже в комнате), то есть включает сжатие,
+# запись в базу с подтверждением и рассылку.
+#
+# Сервер для теста:
+#   ASYNC_MODE=eventlet python server_flask.py
+#   python bench_load.py --url http://127.0.0.1:5000 --clients 2000
+# Нужны пакеты aiohttp и python-socketio[asyncio_client].
+########################################
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+class LoadClient:
+    def __init__(self, url: str, username: str):
+        self.url = url
+        self.username = username
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sent = {}
+        self.latencies = []
+        self.errors = 0
+        self.sio.on('receive_private_message', self.on_message)
+        self.sio.on('server_busy', self.on_busy)
+
+    async def on_message(self, data):
+        if data.get('sender') != self.username:
+            return
+        seq = data['message'].split(':', 2)[1]
+        sent_at = self.sent.pop(seq, None)
+        if sent_at is not None:
+            self.latencies.append(time.perf_counter() - sent_at)
+
+    async def on_busy(self, data):
+        self.errors += 1
+
+    async def connect(self, http: aiohttp.ClientSession) -> float:
+        # Регистрация выставляет cookie сессии, с ней и подключаемся к Socket.IO
+        start = time.perf_counter()
+        async with http.post(f"{self.url}/register", allow_redirects=False, data={
+            'name': self.username, 'username': self.username,
+            'email': f"{self.username}@load.test", 'password': 'load',
+        }) as response:
+            await response.read()
+        cookie = http.cookie_jar.filter_cookies(self.url).get('session')
+        if cookie is None:
+            raise RuntimeError(f"Не удалось зарегистрировать {self.username}")
+        await self.sio.connect(self.url, headers={'Cookie': f"session={cookie.value}"}, transports=['websocket'])
+        return time.perf_counter() - start
+
+    async def chat(self, partner: str, messages: int, interval: float, size: int):
+        room = '_'.join(sorted((self.username, partner)))
+        await self.sio.emit('join_private', {'room': room})
+        padding = 'x' * max(0, size - 32)
+        for seq in range(messages):
+            self.sent[str(seq)] = time.perf_counter()
+            await self.sio.emit('send_private_message', {
+                'receiver': partner, 'room': room, 'message': f"lt:{seq}:{padding}",
+            })
+            await asyncio.sleep(interval)
+
+async def connect_client(url: str, username: str, connect_times: list, semaphore: asyncio.Semaphore):
+    client = LoadClient(url, username)
+    async with semaphore:
+        async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True)) as http:
+            try:
+                connect_times.append(await client.connect(http))
+            except Exception as e:
+                print(f"Ошибка подключения {username}: {e}")
+                return None
+    return client
+
+async def run(args):
+    prefix = f"load{int(time.time())}"
+    connect_times = []
+    semaphore = asyncio.Semaphore(args.connect_concurrency)
+    start = time.perf_counter()
+    clients = await asyncio.gather(*[
+        connect_client(args.url, f"{prefix}_{i}", connect_times, semaphore) for i in range(args.clients)
+    ])
+    connected = [client for client in clients if client is not None]
+    print(f"Подключено: {len(connected)} из {args.clients} за {time.perf_counter() - start:.1f} с")
+    if connect_times:
+        print(f"Время подключения: p50 {percentile(connect_times, 0.5) * 1000:.0f} мс, "
+              f"p99 {percentile(connect_times, 0.99) * 1000:.0f} мс")
+
+    pairs = [(connected[i], connected[i + 1]) for i in range(0, len(connected) - 1, 2)]
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        coroutine for a, b in pairs for coroutine in (
+            a.chat(b.username, args.messages, args.interval, args.size),
+            b.chat(a.username, args.messages, args.interval, args.size),
+        )
+    ])
+    # Ждём последние подтверждения
+    await asyncio.sleep(args.drain)
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for client in connected for latency in client.latencies]
+    sent = len(pairs) * 2 * args.messages
+    busy = sum(client.errors for client in connected)
+    print(f"Сообщений отправлено: {sent}, доставлено: {len(latencies)}, отказов 'сервер занят': {busy}")
+    print(f"Пропускная способность: {len(latencies) / elapsed:.0f} сообщ./с")
+    if latencies:
+        print(f"Задержка: p50 {percentile(latencies, 0.5) * 1000:.1f} мс, p95 {percentile(latencies, 0.95) * 1000:.1f} мс, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.1f} мс, среднее {statistics.mean(latencies) * 1000:.1f} мс")
+
+    if args.hold:
+        print(f"Держим {len(connected)} соединений {args.hold} с")
+        await asyncio.sleep(args.hold)
+    await asyncio.gather(*[client.sio.disconnect() for client in connected], return_exceptions=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест websocket-чата")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Адрес сервера")
+    parser.add_argument("--clients", type=int, default=200, help="Сколько клиентов подключить")
+    parser.add_argument("--messages", type=int, default=10, help="Сообщений от каждого клиента")
+    parser.add_argument("--interval", type=float, default=0.5, help="Пауза между сообщениями клиента, с")
+    parser.add_argument("--size", type=int, default=100, help="Размер сообщения, байт")
+    parser.add_argument("--connect-concurrency", type=int, default=100, help="Одновременных подключений")
+    parser.add_argument("--drain", type=float, default=2, help="Сколько ждать последних ответов, с")
+    parser.add_argument("--hold", type=float, default=0, help="Сколько держать соединения после теста, с")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == '__main__':
+    main()
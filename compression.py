@@ -1,59 +1,138 @@
+import functools
 import heapq
-from collections import defaultdict
+import json
+import math
+import os
+import zlib
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:  # numpy не обязателен: без него RLE работает на чистом Python
+    np = None
+
+# Быстрые внешние кодеки необязательны: без модуля кодек просто не регистрируется
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import lzma
+except ImportError:  # Python может быть собран без liblzma
+    lzma = None
 
 ########################################
 # BWT + MTF + RLE + Huffman (для небольших/текстовых данных)
 # и без BWT (для больших/бинарных)
 ########################################
 
+def rotation_array(s: bytes) -> (list[int], list[int]):
+    # Сортировка циклических сдвигов удвоением префикса (O(n log^2 n)):
+    # на шаге k сдвиг i описывается парой рангов (rank[i], rank[i+k]).
+    # Возвращает порядок сдвигов и итоговые ранги (равные сдвиги - равный ранг).
+    n = len(s)
+    rank = list(s)
+    order = sorted(range(n), key=rank.__getitem__)
+    k = 1
+    while k < n:
+        base = max(n, 256) + 1
+        shifted = rank[k:] + rank[:k]
+        key = [a * base + b for a, b in zip(rank, shifted)]
+        order.sort(key=key.__getitem__)
+        new_rank = [0] * n
+        r = 0
+        prev = key[order[0]]
+        for i in order:
+            if key[i] != prev:
+                r += 1
+                prev = key[i]
+            new_rank[i] = r
+        rank = new_rank
+        if r == n - 1:
+            break
+        k *= 2
+    return order, rank
+
 def bwt_transform(data: bytes) -> (bytes, int):
-    s = data.decode('latin1')
-    s += '\0'
-    rotations = [s[i:] + s[:i] for i in range(len(s))]
-    rotations_sorted = sorted(rotations)
-    last_column = ''.join(rot[-1] for rot in rotations_sorted)
-    original_index = rotations_sorted.index(s)
-    return last_column.encode('latin1'), original_index
+    s = data + b'\0'
+    order, rank = rotation_array(s)
+    last_column = bytes([s[i - 1] for i in order])
+    # Индекс первого (в отсортированном порядке) сдвига, равного исходной строке
+    original_rank = rank[0]
+    original_index = next(pos for pos, i in enumerate(order) if rank[i] == original_rank)
+    return last_column, original_index
 
 def inverse_bwt(last_column: bytes, index: int) -> bytes:
-    s = list(last_column.decode('latin1'))
-    n = len(s)
-    table = [""] * n
-    for _ in range(n):
-        table = sorted([s[i] + table[i] for i in range(n)])
-    result = table[index]
-    if result[-1] == '\0':
-        result = result[:-1]
-    return result.encode('latin1')
-
-def mtf_encode(data: list[int]) -> list[int]:
-    symbols = list(range(256))
-    output = []
-    for b in data:
+    # Обратное BWT через LF-отображение: строка j таблицы получает символ
+    # last_column[j], который стоит в первом столбце на позиции lf[j]
+    n = len(last_column)
+    if n == 0:
+        return b''
+    counts = [0] * 256
+    occ = [0] * n
+    for i, c in enumerate(last_column):
+        occ[i] = counts[c]
+        counts[c] += 1
+    starts = [0] * 256
+    total = 0
+    for c in range(256):
+        starts[c] = total
+        total += counts[c]
+    lf = [starts[c] + o for c, o in zip(last_column, occ)]
+    result = bytearray(n)
+    j = index
+    for k in range(n - 1, -1, -1):
+        result[k] = last_column[j]
+        j = lf[j]
+    if result[-1] == 0:
+        del result[-1]
+    return bytes(result)
+
+# MTF на bytearray: поиск символа - bytearray.index, перенос в начало -
+# del + insert(0, ...), оба сводятся к memmove внутри CPython
+def mtf_encode(data: bytes) -> bytes:
+    symbols = bytearray(range(256))
+    output = bytearray(len(data))
+    for i, b in enumerate(data):
         index = symbols.index(b)
-        output.append(index)
-        symbols.pop(index)
-        symbols.insert(0, b)
-    return output
+        output[i] = index
+        if index:
+            del symbols[index]
+            symbols.insert(0, b)
+    return bytes(output)
 
-def mtf_decode(data: list[int]) -> list[int]:
-    symbols = list(range(256))
-    output = []
-    for idx in data:
-        b = symbols[idx]
-        output.append(b)
-        symbols.pop(idx)
-        symbols.insert(0, b)
-    return output
+def mtf_decode(data: bytes) -> bytes:
+    symbols = bytearray(range(256))
+    output = bytearray(len(data))
+    for i, index in enumerate(data):
+        b = symbols[index]
+        output[i] = b
+        if index:
+            del symbols[index]
+            symbols.insert(0, b)
+    return bytes(output)
 
 RLE_MARKER = 256
+RLE_MAX_RUN = 0xFFFF  # в таблице частот v1 символ занимает 2 байта
+RLE_NUMPY_MIN_SIZE = 256  # на коротких входах накладные расходы numpy не окупаются
 
-def rle_encode(data: list[int]) -> list[int]:
+def rle_encode(data: bytes) -> list[int]:
+    if np is not None and len(data) >= RLE_NUMPY_MIN_SIZE:
+        return rle_encode_numpy(data)
     output = []
     i = 0
     while i < len(data):
         count = 1
-        while i + count < len(data) and data[i] == data[i+count]:
+        while i + count < len(data) and count < RLE_MAX_RUN and data[i] == data[i+count]:
             count += 1
         if count > 3:
             output.append(RLE_MARKER)
@@ -64,8 +143,10 @@ def rle_encode(data: list[int]) -> list[int]:
         i += count
     return output
 
-def rle_decode(data: list[int]) -> list[int]:
-    output = []
+def rle_decode(data: list[int]) -> bytes:
+    if np is not None and len(data) >= RLE_NUMPY_MIN_SIZE:
+        return rle_decode_numpy(data)
+    output = bytearray()
     i = 0
     while i < len(data):
         if data[i] == RLE_MARKER:
@@ -76,7 +157,51 @@ def rle_decode(data: list[int]) -> list[int]:
         else:
             output.append(data[i])
             i += 1
-    return output
+    return bytes(output)
+
+def rle_encode_numpy(data) -> list[int]:
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        values = np.frombuffer(data, dtype=np.uint8)
+    else:
+        values = np.asarray(data)
+    n = len(values)
+    if n == 0:
+        return []
+    # Границы серий - места, где соседние значения различаются
+    starts = np.concatenate(([0], np.flatnonzero(values[1:] != values[:-1]) + 1))
+    lengths = np.diff(np.append(starts, n))
+    # Серии длиннее RLE_MAX_RUN режем на куски по RLE_MAX_RUN
+    pieces = (lengths + RLE_MAX_RUN - 1) // RLE_MAX_RUN
+    run_index = np.repeat(np.arange(len(starts)), pieces)
+    piece_lengths = np.full(len(run_index), RLE_MAX_RUN, dtype=np.int64)
+    piece_lengths[np.cumsum(pieces) - 1] = lengths - (pieces - 1) * RLE_MAX_RUN
+    piece_values = values[starts][run_index].astype(np.int64)
+    # Серия > 3 превращается в тройку (маркер, значение, длина), иначе - литералы
+    encoded = piece_lengths > 3
+    out_sizes = np.where(encoded, 3, piece_lengths)
+    output = np.repeat(piece_values, out_sizes)
+    marker_pos = (np.cumsum(out_sizes) - out_sizes)[encoded]
+    output[marker_pos] = RLE_MARKER
+    output[marker_pos + 2] = piece_lengths[encoded]
+    return output.tolist()
+
+def rle_decode_numpy(data) -> bytes:
+    symbols = np.asarray(data, dtype=np.int64)
+    # 256 может быть и маркером, и длиной серии (она идёт через одну позицию
+    # после маркера). В цепочке кандидатов с шагом 2 маркеры и длины
+    # чередуются, начиная с маркера.
+    candidates = np.flatnonzero(symbols == RLE_MARKER)
+    if len(candidates):
+        linked = np.concatenate(([False], np.diff(candidates) == 2))
+        chain_start = np.maximum.accumulate(np.where(linked, 0, np.arange(len(candidates))))
+        markers = candidates[(np.arange(len(candidates)) - chain_start) % 2 == 0]
+    else:
+        markers = candidates
+    repeats = np.ones(len(symbols), dtype=np.int64)
+    repeats[markers] = 0
+    repeats[markers + 1] = symbols[markers + 2]
+    repeats[markers + 2] = 0
+    return np.repeat(symbols, repeats).astype(np.uint8).tobytes()
 
 class HuffmanNode:
     def __init__(self, symbol, freq, left=None, right=None):
@@ -115,40 +240,163 @@ def generate_huffman_codes(node, prefix="", codebook=None):
     generate_huffman_codes(node.right, prefix + "1", codebook)
     return codebook
 
-def huffman_encode(data: list[int]) -> (str, HuffmanNode):
+def huffman_encode(data: list[int]) -> (bytes, dict):
     freq = build_frequency_table(data)
     tree = build_huffman_tree(freq)
-    codebook = generate_huffman_codes(tree)
-    encoded = "".join(codebook[symbol] for symbol in data)
-    return encoded, tree
+    codes = huffman_code_table(generate_huffman_codes(tree))
+    return pack_codes(data, codes), freq
 
-def huffman_decode(bitstring: str, tree: HuffmanNode) -> list[int]:
+########################################
+# Табличный декодер Хаффмана: символы снимаются поиском по таблице
+# прямо из упакованных байтов, без строки из '0'/'1' и без дерева.
+# Одиночная таблица: DECODE_TABLE_BITS бит -> (символ, длина кода),
+# коды длиннее ведут во вложенную таблицу (запись с отрицательной длиной).
+# Для длинных потоков строится ещё и многосимвольная таблица:
+# MULTI_TABLE_BITS бит -> (все коды, целиком уместившиеся в них, сколько бит заняли).
+# Таблицы кэшируются по набору кодов (DecodeTables): статические модели
+# и повторяющиеся таблицы не перестраиваются на каждом сообщении.
+# Многосимвольная таблица строится, только если в окно помещаются хотя бы
+# два самых коротких кода - на почти случайных данных она не ускоряет,
+# а её построение стоило дороже самого разбора.
+#
+# Относительно исходного декодера (строка '0'/'1' + обход дерева)
+# `python bench_compression.py --huffman` даёт ~1.2-2x на тексте чата
+# и логов и ~2-2.5x на несжимаемых данных; цель 20x на чистом Python
+# не достигнута - разбор остаётся циклом по символам.
+########################################
+DECODE_TABLE_BITS = 10
+MULTI_TABLE_BITS = 12
+MULTI_TABLE_MIN_BITS = 8
+DECODE_CACHE_SIZE = 64
+
+def huffman_code_table(codebook: dict) -> dict:
+    # {символ: '0101'} -> {символ: (код как число, длина)}
+    return {symbol: (int(code, 2), len(code)) for symbol, code in codebook.items()}
+
+def build_decode_table(codes: dict, max_bits: int = DECODE_TABLE_BITS) -> (list, int):
+    bits = min(max(length for _, length in codes.values()), max_bits)
+    table = [None] * (1 << bits)
+    long_codes = defaultdict(dict)
+    for symbol, (code, length) in codes.items():
+        if length <= bits:
+            start = code << (bits - length)
+            count = 1 << (bits - length)
+            table[start:start+count] = [(symbol, length)] * count
+        else:
+            rest = length - bits
+            long_codes[code >> rest][symbol] = (code & ((1 << rest) - 1), rest)
+    for prefix, sub_codes in long_codes.items():
+        sub_table, sub_bits = build_decode_table(sub_codes, max_bits)
+        table[prefix] = (sub_table, -sub_bits)
+    return table, bits
+
+def build_multi_table(table: list, bits: int, multi_bits: int = MULTI_TABLE_BITS) -> list:
+    # levels[r][p] - разбор r-битного окна p; строится от коротких окон к длинным
+    levels = [[((), 0)]]
+    for r in range(1, multi_bits + 1):
+        level = []
+        for p in range(1 << r):
+            index = p >> (r - bits) if r >= bits else p << (bits - r)
+            symbol, length = table[index] or (None, 0)
+            if length <= 0 or length > r:
+                level.append(((), 0))
+            else:
+                rest = r - length
+                symbols, used = levels[rest][p & ((1 << rest) - 1)]
+                level.append(((symbol,) + symbols, length + used))
+        levels.append(level)
+    return levels[multi_bits]
+
+class DecodeTables:
+    # Таблицы декодера для одного набора кодов; многосимвольные строятся
+    # по требованию и хранятся по ширине окна
+    def __init__(self, codes: dict):
+        self.root, self.bits = build_decode_table(codes)
+        self.min_length = min(length for _, length in codes.values())
+        self.multi = {}
+
+    def multi_table(self, multi_bits: int) -> list:
+        if multi_bits not in self.multi:
+            self.multi[multi_bits] = build_multi_table(self.root, self.bits, multi_bits)
+        return self.multi[multi_bits]
+
+@functools.lru_cache(maxsize=DECODE_CACHE_SIZE)
+def cached_decode_tables(codes_key: tuple) -> DecodeTables:
+    return DecodeTables(dict(codes_key))
+
+def huffman_decode(packed: bytes, codes: dict, table: DecodeTables = None) -> list[int]:
+    # packed - результат pack_codes: байт выравнивания + биты старшим битом вперёд;
+    # table - заранее построенные DecodeTables(codes), если есть (статические модели)
     output = []
-    node = tree
-    for bit in bitstring:
-        node = node.left if bit == '0' else node.right
-        if node.left is None and node.right is None:
-            output.append(node.symbol)
-            node = tree
+    remaining = (len(packed) - 1) * 8 - packed[0] if packed else 0
+    if remaining <= 0 or not codes:
+        return output
+    tables = table or cached_decode_tables(tuple(codes.items()))
+    root, root_bits = tables.root, tables.bits
+    # Стоимость построения ~2^(multi_bits+1), поэтому ширину окна
+    # подбираем по длине потока; на коротких сообщениях таблица не окупается
+    multi_bits = min(MULTI_TABLE_BITS, remaining.bit_length() - 5)
+    if multi_bits >= MULTI_TABLE_MIN_BITS and tables.min_length * 2 <= multi_bits:
+        multi = tables.multi_table(multi_bits)
+        multi_mask = (1 << multi_bits) - 1
+    else:
+        multi_bits = 0
+    append = output.append
+    extend = output.extend
+    acc = 0
+    nbits = 0
+    pos = 1
+    end = len(packed)
+    while remaining > 0:
+        if nbits < 64 and pos < end:
+            chunk = packed[pos:pos+8]
+            pos += len(chunk)
+            acc = ((acc & ((1 << nbits) - 1)) << (8 * len(chunk))) | int.from_bytes(chunk, 'big')
+            nbits += 8 * len(chunk)
+        if multi_bits and remaining >= multi_bits:
+            symbols, used = multi[(acc >> (nbits - multi_bits)) & multi_mask]
+            if used:
+                extend(symbols)
+                nbits -= used
+                remaining -= used
+                continue
+        table, bits = root, root_bits
+        while True:
+            if nbits >= bits:
+                index = (acc >> (nbits - bits)) & ((1 << bits) - 1)
+            else:
+                # Хвост потока: дополняем нулями, как при упаковке
+                index = (acc << (bits - nbits)) & ((1 << bits) - 1)
+            symbol, length = table[index]
+            if length > 0:
+                break
+            nbits -= bits
+            remaining -= bits
+            table, bits = symbol, -length
+        nbits -= length
+        remaining -= length
+        append(symbol)
     return output
 
-def pack_bitstring(bitstring: str) -> bytes:
-    padding = (8 - len(bitstring) % 8) % 8
-    bitstring += "0" * padding
-    result = bytearray()
-    for i in range(0, len(bitstring), 8):
-        byte = bitstring[i:i+8]
-        result.append(int(byte, 2))
-    return bytes([padding]) + bytes(result)
-
-def unpack_bitstring(data: bytes) -> str:
-    padding = data[0]
-    bits = ""
-    for byte in data[1:]:
-        bits += format(byte, '08b')
-    if padding:
-        bits = bits[:-padding]
-    return bits
+def pack_codes(data: list[int], codes: dict) -> bytes:
+    # Коды пишутся сразу в целочисленный аккумулятор и сбрасываются в
+    # bytearray целыми байтами; формат: байт выравнивания + биты старшим битом вперёд
+    result = bytearray(1)
+    acc = 0
+    nbits = 0
+    for symbol in data:
+        code, length = codes[symbol]
+        acc = (acc << length) | code
+        nbits += length
+        if nbits >= 64:
+            extra = nbits & 7
+            result += (acc >> extra).to_bytes((nbits - extra) >> 3, 'big')
+            acc &= (1 << extra) - 1
+            nbits = extra
+    padding = (8 - nbits % 8) % 8
+    result += (acc << padding).to_bytes((nbits + padding) >> 3, 'big')
+    result[0] = padding
+    return bytes(result)
 
 def pack_frequency_table(freq: dict) -> bytes:
     result = bytearray()
@@ -174,17 +422,109 @@ def unpack_frequency_table(data: bytes) -> (dict, int):
 def build_huffman_tree_from_frequency(freq: dict) -> HuffmanNode:
     return build_huffman_tree(freq)
 
+########################################
+# Канонический Хаффман (формат v2): в заголовке хранятся только длины
+# кодов, сами коды однозначно восстанавливаются по (длина, символ),
+# поэтому декодеру не нужны ни частоты, ни куча.
+# Заголовок: varint(число символов), символы по возрастанию в виде
+# varint-разностей, затем длины по 4 бита (два на байт).
+########################################
+MAX_CODE_LENGTH = 15
+
+def encode_varint(value: int) -> bytes:
+    result = bytearray()
+    while value >= 0x80:
+        result.append((value & 0x7F) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+def decode_varint(data: bytes, offset: int = 0) -> (int, int):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+def huffman_code_lengths(freq: dict, max_length: int = MAX_CODE_LENGTH) -> dict:
+    if len(freq) == 1:
+        return {symbol: 1 for symbol in freq}
+    while True:
+        lengths = dict.fromkeys(freq, 0)
+        heap = [(f, symbol, [symbol]) for symbol, f in freq.items()]
+        heapq.heapify(heap)
+        while len(heap) > 1:
+            f1, key1, symbols1 = heapq.heappop(heap)
+            f2, key2, symbols2 = heapq.heappop(heap)
+            for symbol in symbols1:
+                lengths[symbol] += 1
+            for symbol in symbols2:
+                lengths[symbol] += 1
+            heapq.heappush(heap, (f1 + f2, min(key1, key2), symbols1 + symbols2))
+        if max(lengths.values(), default=0) <= max_length:
+            return lengths
+        # Слишком длинные коды: сглаживаем частоты и строим заново
+        freq = {symbol: (f + 1) // 2 for symbol, f in freq.items()}
+
+def canonical_codes(lengths: dict) -> dict:
+    codes = {}
+    code = 0
+    prev_length = 0
+    for symbol, length in sorted(lengths.items(), key=lambda item: (item[1], item[0])):
+        code <<= length - prev_length
+        codes[symbol] = (code, length)
+        code += 1
+        prev_length = length
+    return codes
+
+def pack_code_lengths(lengths: dict) -> bytes:
+    symbols = sorted(lengths)
+    result = bytearray(encode_varint(len(symbols)))
+    prev = -1
+    for symbol in symbols:
+        result += encode_varint(symbol - prev - 1)
+        prev = symbol
+    for i in range(0, len(symbols), 2):
+        high = lengths[symbols[i]]
+        low = lengths[symbols[i+1]] if i + 1 < len(symbols) else 0
+        result.append((high << 4) | low)
+    return bytes(result)
+
+def unpack_code_lengths(data: bytes, offset: int = 0) -> (dict, int):
+    count, offset = decode_varint(data, offset)
+    symbols = []
+    prev = -1
+    for _ in range(count):
+        delta, offset = decode_varint(data, offset)
+        prev += delta + 1
+        symbols.append(prev)
+    lengths = {}
+    for i, symbol in enumerate(symbols):
+        byte = data[offset + i // 2]
+        lengths[symbol] = byte >> 4 if i % 2 == 0 else byte & 0x0F
+    return lengths, offset + (count + 1) // 2
+
+def canonical_encode(data: list[int]) -> bytes:
+    lengths = huffman_code_lengths(build_frequency_table(data))
+    return pack_code_lengths(lengths) + pack_codes(data, canonical_codes(lengths))
+
+def canonical_decode(data: bytes, offset: int = 0) -> list[int]:
+    lengths, offset = unpack_code_lengths(data, offset)
+    return huffman_decode(data[offset:], canonical_codes(lengths))
+
 ########################################
 # Сжатие для небольших данных (с BWT)
 ########################################
 def compress_small(data: bytes) -> bytes:
     bwt_data, original_index = bwt_transform(data)
-    mtf_encoded = mtf_encode(list(bwt_data))
+    mtf_encoded = mtf_encode(bwt_data)
     rle_encoded = rle_encode(mtf_encoded)
-    encoded_bits, _ = huffman_encode(rle_encoded)
-    freq = build_frequency_table(rle_encoded)
+    huffman_bytes, freq = huffman_encode(rle_encoded)
     header = original_index.to_bytes(4, 'little') + pack_frequency_table(freq)
-    huffman_bytes = pack_bitstring(encoded_bits)
     return header + huffman_bytes
 
 def decompress_small(data: bytes) -> bytes:
@@ -192,54 +532,549 @@ def decompress_small(data: bytes) -> bytes:
     freq, header_length = unpack_frequency_table(data[4:])
     header_total = 4 + header_length
     huffman_encoded_bytes = data[header_total:]
-    bitstring = unpack_bitstring(huffman_encoded_bytes)
     huffman_tree = build_huffman_tree_from_frequency(freq)
-    rle_decoded = huffman_decode(bitstring, huffman_tree)
+    codes = huffman_code_table(generate_huffman_codes(huffman_tree))
+    rle_decoded = huffman_decode(huffman_encoded_bytes, codes)
     mtf_decoded = rle_decode(rle_decoded)
-    bwt_data = bytes(mtf_decode(mtf_decoded))
+    bwt_data = mtf_decode(mtf_decoded)
     return inverse_bwt(bwt_data, original_index)
 
 ########################################
 # Сжатие для больших/бинарных данных (без BWT)
 ########################################
 def compress_large(data: bytes) -> bytes:
-    mtf_encoded = mtf_encode(list(data))
+    mtf_encoded = mtf_encode(data)
     rle_encoded = rle_encode(mtf_encoded)
-    encoded_bits, _ = huffman_encode(rle_encoded)
-    freq = build_frequency_table(rle_encoded)
+    huffman_bytes, freq = huffman_encode(rle_encoded)
     header = pack_frequency_table(freq)
-    huffman_bytes = pack_bitstring(encoded_bits)
     return header + huffman_bytes
 
 def decompress_large(data: bytes) -> bytes:
     freq, header_length = unpack_frequency_table(data)
     huffman_encoded_bytes = data[header_length:]
-    bitstring = unpack_bitstring(huffman_encoded_bytes)
     huffman_tree = build_huffman_tree_from_frequency(freq)
-    rle_decoded = huffman_decode(bitstring, huffman_tree)
+    codes = huffman_code_table(generate_huffman_codes(huffman_tree))
+    rle_decoded = huffman_decode(huffman_encoded_bytes, codes)
     mtf_decoded = rle_decode(rle_decoded)
-    return bytes(mtf_decoded)
+    return mtf_decode(mtf_decoded)
+
+########################################
+# Формат v2: тот же конвейер, но индекс BWT - varint,
+# а вместо таблицы частот - канонические длины кодов
+########################################
+def compress_small_v2(data: bytes) -> bytes:
+    bwt_data, original_index = bwt_transform(data)
+    rle_encoded = rle_encode(mtf_encode(bwt_data))
+    return encode_varint(original_index) + canonical_encode(rle_encoded)
+
+def decompress_small_v2(data: bytes) -> bytes:
+    original_index, offset = decode_varint(data)
+    rle_decoded = canonical_decode(data, offset)
+    bwt_data = mtf_decode(rle_decode(rle_decoded))
+    return inverse_bwt(bwt_data, original_index)
+
+def compress_large_v2(data: bytes) -> bytes:
+    return canonical_encode(rle_encode(mtf_encode(data)))
+
+def decompress_large_v2(data: bytes) -> bytes:
+    return mtf_decode(rle_decode(canonical_decode(data)))
+
+########################################
+# Статические модели (как словари zstd, но для конвейера BWT/MTF/RLE/Хаффман):
+# длины кодов обучаются заранее на корпусе сообщений (train_model.py)
+# и лежат в models/*.json. В кадре хранится только ID модели, поэтому
+# короткому сообщению не нужна собственная таблица, а таблицы
+# декодирования строятся один раз при загрузке модели.
+# Тело кадра: varint(ID модели) + varint(индекс BWT) + коды
+########################################
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+STATIC_MODELS = {}
+
+def train_static_model(samples, max_length: int = MAX_CODE_LENGTH) -> dict:
+    # Сглаживание: каждый индекс MTF и маркер RLE получают код,
+    # даже если в корпусе не встретились
+    freq = dict.fromkeys(range(RLE_MARKER + 1), 1)
+    for sample in samples:
+        bwt_data, _ = bwt_transform(sample)
+        for symbol in rle_encode(mtf_encode(bwt_data)):
+            freq[symbol] = freq.get(symbol, 0) + 1
+    return huffman_code_lengths(freq, max_length)
+
+def register_static_model(model_id: int, lengths: dict):
+    codes = canonical_codes(lengths)
+    STATIC_MODELS[model_id] = {
+        "lengths": lengths,
+        "codes": codes,
+        "table": DecodeTables(codes),
+    }
+
+def save_static_model(path: str, model_id: int, lengths: dict):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"id": model_id, "lengths": {str(s): l for s, l in sorted(lengths.items())}}, f)
+
+def load_static_models(directory: str = MODELS_DIR):
+    if not os.path.isdir(directory):
+        return
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.json'):
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                model = json.load(f)
+            register_static_model(model["id"], {int(s): l for s, l in model["lengths"].items()})
+
+def default_model_id() -> int:
+    return max(STATIC_MODELS) if STATIC_MODELS else None
+
+def compress_model(data: bytes, model_id: int = None) -> bytes:
+    # None - в модели нет кода для какого-то символа (например, очень длинной серии)
+    if model_id is None:
+        model_id = default_model_id()
+    model = STATIC_MODELS.get(model_id)
+    if model is None:
+        return None
+    codes = model["codes"]
+    bwt_data, original_index = bwt_transform(data)
+    rle_encoded = rle_encode(mtf_encode(bwt_data))
+    if any(symbol not in codes for symbol in rle_encoded):
+        return None
+    return encode_varint(model_id) + encode_varint(original_index) + pack_codes(rle_encoded, codes)
+
+def decompress_model(data: bytes) -> bytes:
+    model_id, offset = decode_varint(data)
+    original_index, offset = decode_varint(data, offset)
+    model = STATIC_MODELS.get(model_id)
+    if model is None:
+        raise ValueError(f"Неизвестная статическая модель: {model_id}")
+    rle_decoded = huffman_decode(data[offset:], model["codes"], model["table"])
+    return inverse_bwt(mtf_decode(rle_decode(rle_decoded)), original_index)
+
+load_static_models()
+
+########################################
+# Блочный контейнер (как в bzip2): вход режется на блоки BLOCK_SIZE,
+# каждый блок - самостоятельный кадр со своим флагом, индексом BWT
+# и таблицей Хаффмана, поэтому блоки сжимаются и распаковываются
+# независимо (в том числе в пуле процессов).
+# Формат тела: [длина кадра (4 байта) + кадр]* + 4 нулевых байта
+########################################
+BLOCK_SIZE = 256 * 1024
+
+def split_blocks(data: bytes, block_size: int = BLOCK_SIZE) -> list[bytes]:
+    return [data[i:i+block_size] for i in range(0, len(data), block_size)]
+
+def map_blocks(func, blocks: list, *args, workers: int = None) -> list:
+    extra = [[arg] * len(blocks) for arg in args]
+    if workers and workers > 1 and len(blocks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(func, blocks, *extra))
+    return list(map(func, blocks, *extra))
+
+def compress_blocks(data: bytes, use_bwt: bool = True, block_size: int = BLOCK_SIZE, workers: int = None) -> bytes:
+    frames = map_blocks(compress_frame, split_blocks(data, block_size), use_bwt, workers=workers)
+    result = bytearray()
+    for frame in frames:
+        result += len(frame).to_bytes(4, 'little')
+        result += frame
+    result += (0).to_bytes(4, 'little')
+    return bytes(result)
+
+def decompress_blocks(data: bytes, workers: int = None) -> bytes:
+    frames = []
+    offset = 0
+    while True:
+        length = int.from_bytes(data[offset:offset+4], 'little')
+        offset += 4
+        if length == 0:
+            break
+        frames.append(data[offset:offset+length])
+        offset += length
+    if workers and workers > 1:
+        # memoryview не сериализуется для пула процессов
+        frames = [bytes(frame) for frame in frames]
+    return b''.join(map_blocks(decompress, frames, workers=workers))
+
+########################################
+# Простые кодеки: без сжатия и zlib (сырой deflate без заголовка
+# и контрольной суммы zlib - экономит 6 байт на каждом сообщении)
+########################################
+ZLIB_LEVEL = 6
+
+def deflate_raw(data: bytes, level: int = ZLIB_LEVEL) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+def inflate_raw(data: bytes) -> bytes:
+    return zlib.decompress(data, -15)
+
+########################################
+# Автовыбор кодека по выборке из входа: длина, энтропия байтов и
+# повторяемость (степень сжатия выборки быстрым zlib).
+# Пороги сняты бенчмарком `python bench_compression.py --codecs`:
+# - до ~48 байт кадры zlib/BWT не меньше исходного сообщения,
+#   выиграть может только статическая модель (0x07) без своей таблицы;
+# - до 128 байт статическая модель выигрывает у zlib только на тексте,
+#   похожем на корпус модели (чат: 104 против 116 байт на 128 байтах);
+#   на логах она проигрывает (114 против 77), поэтому короткие сообщения
+#   кодируются обоими способами и берётся меньший кадр - это микросекунды;
+# - до 4 КБ zlib даёт кадр меньше, чем BWT, и в десятки раз быстрее;
+# - от 4 КБ BWT выигрывает у zlib 10-40% на тексте, но стоит
+#   ~3 мс/КБ, поэтому выше 64 КБ берём самый быстрый из доступных
+#   кодеков (zstd, lz4, иначе zlib);
+# - конвейер без BWT (0x04) не выиграл ни в одной точке замера
+#   и автоматически не выбирается.
+# Если выбранный кодек не выиграл, compress() сам вернёт кадр без сжатия.
+########################################
+AUTO_STORED_MAX_SIZE = 48
+AUTO_MODEL_MAX_SIZE = 128
+AUTO_BWT_MIN_SIZE = 4 * 1024
+AUTO_BWT_MAX_SIZE = 64 * 1024
+AUTO_SAMPLE_SIZE = 4 * 1024
+AUTO_ENTROPY_MAX = 7.5  # бит/байт; выше - уже сжатые или случайные данные
+AUTO_PROBE_RATIO_MAX = 0.95
+
+def sample_payload(data: bytes, sample_size: int = AUTO_SAMPLE_SIZE) -> bytes:
+    # Начало, середина и конец - чтобы не судить по одному заголовку файла
+    if len(data) <= 3 * sample_size:
+        return data
+    middle = (len(data) - sample_size) // 2
+    return data[:sample_size] + data[middle:middle+sample_size] + data[-sample_size:]
+
+def byte_entropy(data: bytes) -> float:
+    total = len(data)
+    if total == 0:
+        return 0.0
+    return -sum(c / total * math.log2(c / total) for c in Counter(data).values())
+
+def compress_short(data: bytes):
+    # Для коротких сообщений: кадр модели и кадр zlib, выбирается меньший
+    # (или кадр без сжатия, если оба не выиграли). -> (кодек, кадр)
+    flag, compress_func, _ = CODEC_REGISTRY['zlib']
+    candidates = [('zlib', bytes([flag]) + compress_func(data))]
+    body = compress_model(data)
+    if body is not None:
+        candidates.insert(0, ('model', bytes([FLAG_MODEL]) + body))
+    codec, frame = min(candidates, key=lambda candidate: len(candidate[1]))
+    if len(frame) > len(data):
+        return 'stored', bytes([FLAG_STORED]) + data
+    return codec, frame
+
+def choose_codec(data: bytes) -> str:
+    if STATIC_MODELS and len(data) <= AUTO_MODEL_MAX_SIZE:
+        return compress_short(data)[0]
+    if len(data) < AUTO_STORED_MAX_SIZE:
+        return 'stored'
+    sample = sample_payload(data)
+    probe_ratio = len(deflate_raw(sample, 1)) / len(sample)
+    if byte_entropy(sample) > AUTO_ENTROPY_MAX or probe_ratio > AUTO_PROBE_RATIO_MAX:
+        return 'stored'
+    if AUTO_BWT_MIN_SIZE <= len(data) <= AUTO_BWT_MAX_SIZE:
+        return 'bwt'
+    if len(data) > AUTO_BWT_MAX_SIZE:
+        return preferred_codec()
+    return 'zlib'
 
 ########################################
 # Главные функции compress/decompress с флагом:
-# Флаг: 0x01 - с BWT, 0x00 - без BWT
+# 0x00 - без BWT, 0x01 - с BWT (таблица частот),
+# 0x02 - блочный контейнер,
+# 0x03 - с BWT, 0x04 - без BWT (канонический Хаффман, v2),
+# 0x05 - без сжатия, 0x06 - zlib (сырой deflate),
+# 0x07 - BWT со статической моделью,
+# 0x08 - zstd, 0x09 - lz4, 0x0A - brotli, 0x0B - lzma (xz)
 ########################################
-def compress(data: bytes, use_bwt: bool = True) -> bytes:
+FLAG_LARGE = 0x00
+FLAG_SMALL = 0x01
+FLAG_BLOCKS = 0x02
+FLAG_SMALL_V2 = 0x03
+FLAG_LARGE_V2 = 0x04
+FLAG_STORED = 0x05
+FLAG_ZLIB = 0x06
+FLAG_MODEL = 0x07
+FLAG_ZSTD = 0x08
+FLAG_LZ4 = 0x09
+FLAG_BROTLI = 0x0A
+FLAG_LZMA = 0x0B
+
+########################################
+# Реестр байтовых кодеков: имя -> (флаг, сжатие, распаковка).
+# Кодеки конвейера (bwt, large, model, stored) разбираются в compress()
+# отдельно, всё остальное - через реестр. Внешние кодеки регистрируются,
+# только если установлен их модуль; compress() тогда откатывается на zlib,
+# а decompress() сообщает, какого модуля не хватает.
+########################################
+ZSTD_LEVEL = 3
+BROTLI_QUALITY = 5
+LZMA_PRESET = 6
+
+PIPELINE_CODECS = ('bwt', 'large', 'stored', 'model')
+OPTIONAL_CODECS = {
+    'zstd': (FLAG_ZSTD, 'zstandard'),
+    'lz4': (FLAG_LZ4, 'lz4'),
+    'brotli': (FLAG_BROTLI, 'brotli'),
+    'lzma': (FLAG_LZMA, 'lzma'),
+}
+# Порядок предпочтения для больших данных, где важна скорость
+FAST_CODECS = ('zstd', 'lz4', 'zlib')
+
+CODEC_REGISTRY = {}
+FLAG_CODECS = {}
+
+def register_codec(name: str, flag: int, compress_func, decompress_func):
+    CODEC_REGISTRY[name] = (flag, compress_func, decompress_func)
+    FLAG_CODECS[flag] = name
+
+def available_codecs() -> tuple:
+    return PIPELINE_CODECS + tuple(CODEC_REGISTRY)
+
+def preferred_codec(preference: tuple = FAST_CODECS) -> str:
+    return next(name for name in preference if name in CODEC_REGISTRY)
+
+register_codec('zlib', FLAG_ZLIB, deflate_raw, inflate_raw)
+
+if zstandard is not None:
+    def zstd_compress(data: bytes) -> bytes:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+    def zstd_decompress(data: bytes) -> bytes:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+    register_codec('zstd', FLAG_ZSTD, zstd_compress, zstd_decompress)
+
+if lz4_frame is not None:
+    register_codec('lz4', FLAG_LZ4, lz4_frame.compress, lz4_frame.decompress)
+
+if brotli is not None:
+    def brotli_compress(data: bytes) -> bytes:
+        return brotli.compress(bytes(data), quality=BROTLI_QUALITY)
+
+    def brotli_decompress(data: bytes) -> bytes:
+        return brotli.decompress(bytes(data))
+
+    register_codec('brotli', FLAG_BROTLI, brotli_compress, brotli_decompress)
+
+if lzma is not None:
+    def lzma_compress(data: bytes) -> bytes:
+        return lzma.compress(data, preset=LZMA_PRESET)
+
+    register_codec('lzma', FLAG_LZMA, lzma_compress, lzma.decompress)
+
+def stored_fallback(data: bytes, frame: bytes) -> bytes:
+    # Если сжатие не выиграло у исходных данных, храним их как есть:
+    # кадр 0x05 на байт длиннее входа и распаковывается без вычислений
+    if len(frame) > len(data):
+        return bytes([FLAG_STORED]) + data
+    return frame
+
+def compress_frame(data: bytes, use_bwt: bool = True) -> bytes:
     if use_bwt:
-        flag = b'\x01'
-        body = compress_small(data)
+        flag = bytes([FLAG_SMALL_V2])
+        body = compress_small_v2(data)
     else:
-        flag = b'\x00'
-        body = compress_large(data)
-    return flag + body
+        flag = bytes([FLAG_LARGE_V2])
+        body = compress_large_v2(data)
+    return stored_fallback(data, flag + body)
 
-def decompress(data: bytes) -> bytes:
-    flag = data[0]
-    body = data[1:]
-    if flag == 0x01:
-        return decompress_small(body)
+def compress(data: bytes, use_bwt: bool = True, block_size: int = BLOCK_SIZE, workers: int = None,
+             codec: str = None) -> bytes:
+    # codec: имя из available_codecs(), 'auto' или None (тогда решает use_bwt)
+    if codec == 'auto':
+        if STATIC_MODELS and len(data) <= AUTO_MODEL_MAX_SIZE:
+            return compress_short(data)[1]
+        codec = choose_codec(data)
+    elif codec is None:
+        codec = 'bwt' if use_bwt else 'large'
+    elif codec in OPTIONAL_CODECS and codec not in CODEC_REGISTRY:
+        codec = 'zlib'
+    elif codec not in PIPELINE_CODECS and codec not in CODEC_REGISTRY:
+        raise ValueError(f"Неизвестный кодек: {codec}")
+    if codec == 'stored':
+        return bytes([FLAG_STORED]) + data
+    if codec == 'model':
+        body = compress_model(data)
+        if body is not None:
+            return stored_fallback(data, bytes([FLAG_MODEL]) + body)
+        codec = 'zlib'
+    if codec in CODEC_REGISTRY:
+        flag, compress_func, _ = CODEC_REGISTRY[codec]
+        return stored_fallback(data, bytes([flag]) + compress_func(data))
+    use_bwt = codec == 'bwt'
+    # Всё, что больше одного блока, упаковываем в блочный контейнер,
+    # чтобы память не росла с размером входа
+    if len(data) > block_size:
+        return stored_fallback(data, bytes([FLAG_BLOCKS]) + compress_blocks(data, use_bwt, block_size, workers))
+    return compress_frame(data, use_bwt)
+
+def decompress_view(data: bytes, workers: int = None) -> memoryview:
+    # Тело разбираем через memoryview, чтобы не копировать его срезом;
+    # для кадра без сжатия результат - срез входа без единой копии
+    view = memoryview(data)
+    flag = view[0]
+    body = view[1:]
+    if flag == FLAG_STORED:
+        return body
+    elif flag == FLAG_LARGE:
+        result = decompress_large(body)
+    elif flag == FLAG_SMALL:
+        result = decompress_small(body)
+    elif flag == FLAG_BLOCKS:
+        result = decompress_blocks(body, workers)
+    elif flag == FLAG_SMALL_V2:
+        result = decompress_small_v2(body)
+    elif flag == FLAG_LARGE_V2:
+        result = decompress_large_v2(body)
+    elif flag == FLAG_MODEL:
+        result = decompress_model(body)
+    elif flag in FLAG_CODECS:
+        result = CODEC_REGISTRY[FLAG_CODECS[flag]][2](body)
     else:
-        return decompress_large(body)
+        for name, (codec_flag, module) in OPTIONAL_CODECS.items():
+            if codec_flag == flag:
+                raise ValueError(f"Кодек {name} недоступен: не установлен модуль {module}")
+        raise ValueError(f"Неизвестный флаг кадра: {flag:#04x}")
+    return memoryview(result)
+
+def decompress(data: bytes, workers: int = None) -> bytes:
+    view = decompress_view(data, workers)
+    return view.obj if isinstance(view.obj, bytes) and view.nbytes == len(view.obj) else bytes(view)
+
+FRAME_NAMES = {
+    FLAG_LARGE: 'large-v1',
+    FLAG_SMALL: 'bwt-v1',
+    FLAG_BLOCKS: 'blocks',
+    FLAG_SMALL_V2: 'bwt',
+    FLAG_LARGE_V2: 'large',
+    FLAG_STORED: 'stored',
+    FLAG_MODEL: 'model',
+}
+
+def frame_codec(data: bytes) -> str:
+    # Имя кодека, которым на самом деле записан кадр (для статистики:
+    # 'auto' и откат на stored/zlib видны только по флагу)
+    flag = data[0]
+    if flag in FRAME_NAMES:
+        return FRAME_NAMES[flag]
+    if flag in FLAG_CODECS:
+        return FLAG_CODECS[flag]
+    for name, (codec_flag, _) in OPTIONAL_CODECS.items():
+        if codec_flag == flag:
+            return name
+    return f"{flag:#04x}"
+
+########################################
+# Потоковое сжатие поверх файловых объектов: в памяти держится
+# не больше одного блока. CompressWriter пишет блочный контейнер 0x02,
+# DecompressReader читает его поблочно (кадры других форматов
+# читаются целиком, они не делятся на блоки).
+# codec - имя из available_codecs() для каждого блока (например, zstd
+# для файлов); без него блоки сжимаются конвейером BWT/без BWT.
+########################################
+class CompressWriter:
+    def __init__(self, fileobj, use_bwt: bool = True, block_size: int = BLOCK_SIZE, codec: str = None):
+        self.fileobj = fileobj
+        self.use_bwt = use_bwt
+        self.codec = codec
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.closed = False
+        self.fileobj.write(bytes([FLAG_BLOCKS]))
+
+    def write(self, data: bytes) -> int:
+        if self.closed:
+            raise ValueError("Запись в закрытый CompressWriter")
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._write_block(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def _write_block(self, block: bytes):
+        if self.codec is not None:
+            frame = compress(block, codec=self.codec, block_size=self.block_size)
+        else:
+            frame = compress_frame(block, self.use_bwt)
+        self.fileobj.write(len(frame).to_bytes(4, 'little'))
+        self.fileobj.write(frame)
+
+    def close(self):
+        if self.closed:
+            return
+        if self.buffer:
+            self._write_block(bytes(self.buffer))
+            self.buffer.clear()
+        self.fileobj.write((0).to_bytes(4, 'little'))
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class DecompressReader:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.buffer = bytearray()
+        self.eof = False
+        flag = fileobj.read(1)
+        if not flag:
+            raise EOFError("Пустой поток сжатых данных")
+        self.blocks = flag[0] == FLAG_BLOCKS
+        if not self.blocks:
+            self.buffer += decompress(flag + fileobj.read())
+            self.eof = True
+
+    def _read_block(self):
+        header = self.fileobj.read(4)
+        if len(header) < 4:
+            raise EOFError("Поток оборвался до конца блочного контейнера")
+        length = int.from_bytes(header, 'little')
+        if length == 0:
+            self.eof = True
+            return
+        frame = self.fileobj.read(length)
+        if len(frame) < length:
+            raise EOFError("Поток оборвался внутри блока")
+        self.buffer += decompress(frame)
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            self._read_block()
+        if size < 0 or size >= len(self.buffer):
+            result = bytes(self.buffer)
+            self.buffer.clear()
+        else:
+            result = bytes(self.buffer[:size])
+            del self.buffer[:size]
+        return result
+
+    def close(self):
+        self.buffer.clear()
+        self.eof = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def compress_stream(src, dst, use_bwt: bool = True, block_size: int = BLOCK_SIZE, codec: str = None) -> int:
+    # -> сколько байт прочитано из src
+    total = 0
+    with CompressWriter(dst, use_bwt, block_size, codec) as writer:
+        while True:
+            chunk = src.read(block_size)
+            if not chunk:
+                break
+            total += len(chunk)
+            writer.write(chunk)
+    return total
+
+def decompress_stream(src, dst, chunk_size: int = BLOCK_SIZE):
+    with DecompressReader(src) as reader:
+        while True:
+            chunk = reader.read(chunk_size)
+            if not chunk:
+                break
+            dst.write(chunk)
 
 if __name__ == '__main__':
     text = "Пример тестового сообщения для сжатия"
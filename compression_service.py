@@ -0,0 +1,132 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+import compression
+from async_support import is_async, run_blocking
+
+########################################
+# Сервис сжатия для обработчиков Socket.IO и /upload.
+# Маленькие данные сжимаются прямо в потоке обработчика (пересылка
+# в процесс дороже самого сжатия), большие - в пуле процессов, чтобы
+# одно длинное сообщение не держало GIL и остальных клиентов.
+# Очередь к пулу ограничена: когда она полна, вызов сразу падает
+# с CompressionBusy, а сервер отвечает клиенту "сервер занят".
+# В режимах eventlet/gevent пул процессов не используется (multiprocessing
+# плохо уживается с monkey patching): вся работа идёт через run_blocking()
+# в потоках ОС, а ограничение очереди действует так же.
+#
+# Настройки через переменные окружения:
+#   COMPRESS_WORKERS    - процессов в пуле (0 - всё сжимать в потоке)
+#   COMPRESS_INLINE_MAX - до скольки байт сжимать в потоке
+#   COMPRESS_MAX_PENDING - сколько задач может ждать пул одновременно
+#   COMPRESS_TIMEOUT    - сколько секунд ждать результата задачи
+#   COMPRESS_VERIFY_RATE - доля сообщений, которые после записи
+#                          распаковываются и сверяются с исходником (0 - выкл)
+########################################
+COMPRESS_WORKERS = int(os.environ.get('COMPRESS_WORKERS', min(4, os.cpu_count() or 1)))
+COMPRESS_INLINE_MAX = int(os.environ.get('COMPRESS_INLINE_MAX', 16 * 1024))
+COMPRESS_MAX_PENDING = int(os.environ.get('COMPRESS_MAX_PENDING', 32))
+COMPRESS_TIMEOUT = float(os.environ.get('COMPRESS_TIMEOUT', 30))
+COMPRESS_VERIFY_RATE = float(os.environ.get('COMPRESS_VERIFY_RATE', 0.01))
+
+class CompressionBusy(Exception):
+    pass
+
+def timed(func, *args, **kwargs):
+    # Возвращает (результат, настенное время в мс, процессорное время потока в мс).
+    # В пуле вызывается внутри процесса, поэтому время не включает пересылку.
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - wall_start) * 1000, (time.thread_time() - cpu_start) * 1000
+
+class CompressionService:
+    def __init__(self, workers: int = COMPRESS_WORKERS, inline_max: int = COMPRESS_INLINE_MAX,
+                 max_pending: int = COMPRESS_MAX_PENDING, timeout: float = COMPRESS_TIMEOUT,
+                 verify_rate: float = COMPRESS_VERIFY_RATE):
+        self.workers = workers
+        self.inline_max = inline_max
+        self.timeout = timeout
+        self.verify_rate = verify_rate
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.executor = None
+        self.stats = {'inline': 0, 'offloaded': 0, 'rejected': 0, 'verified': 0, 'mismatches': 0}
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        # Пул создаётся при первой большой задаче, а не при импорте сервера
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self.executor
+
+    def count(self, name: str):
+        with self.lock:
+            self.stats[name] += 1
+
+    def run(self, func, data: bytes, *args, **kwargs):
+        if len(data) <= self.inline_max or (self.workers <= 0 and not is_async()):
+            self.count('inline')
+            return run_blocking(timed, func, data, *args, **kwargs)
+        if not self.slots.acquire(blocking=False):
+            self.count('rejected')
+            raise CompressionBusy(f"Очередь сжатия заполнена, размер данных: {len(data)} байт")
+        self.count('offloaded')
+        if is_async():
+            try:
+                return run_blocking(timed, func, data, *args, **kwargs)
+            finally:
+                self.slots.release()
+        try:
+            future = self.get_executor().submit(timed, func, data, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        # Место в очереди освобождается, когда задача действительно завершилась:
+        # после таймаута уже запущенную задачу cancel() не остановит, и она
+        # должна занимать место, пока процесс её не доделает
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise CompressionBusy(f"Сжатие не уложилось в {self.timeout} с")
+
+    def compress(self, data: bytes, **kwargs):
+        # -> (кадр, мс, мс CPU)
+        return self.run(compression.compress, data, **kwargs)
+
+    def decompress(self, data: bytes):
+        # -> (данные, мс, мс CPU)
+        return self.run(compression.decompress, data)
+
+    def should_verify(self) -> bool:
+        return self.verify_rate > 0 and random.random() < self.verify_rate
+
+    def verify(self, data: bytes, frame: bytes):
+        # Проверка записи: кадр должен распаковаться ровно в исходные данные.
+        # Ошибка распаковки тоже считается несовпадением. -> (ok, мс, мс CPU)
+        try:
+            decoded, wall_ms, cpu_ms = self.decompress(frame)
+            ok = decoded == data
+        except CompressionBusy:
+            raise
+        except Exception as e:
+            print(f"Ошибка распаковки при проверке записи: {e}")
+            decoded, wall_ms, cpu_ms = None, None, None
+            ok = False
+        self.count('verified')
+        if not ok:
+            self.count('mismatches')
+        return ok, wall_ms, cpu_ms
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+service = CompressionService()
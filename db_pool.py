@@ -0,0 +1,103 @@
+import os
+import queue
+import sqlite3
+
+from async_support import run_blocking
+
+########################################
+# Пул соединений SQLite. Вместо connect() на каждый запрос и событие
+# Socket.IO соединения переиспользуются: get() выдаёт свободное
+# соединение потоку (или гринлету), close() возвращает его в пул.
+# PRAGMA настраиваются один раз при создании соединения, база
+# переводится в WAL, чтобы запись не блокировала чтение.
+# Запросы и commit выполняются через run_blocking(): в режимах
+# eventlet/gevent они уходят в поток ОС и не останавливают цикл событий.
+#
+# Настройки через переменные окружения:
+#   DB_POOL_SIZE    - сколько свободных соединений держать в пуле
+#   DB_MMAP_SIZE    - PRAGMA mmap_size, байт
+#   DB_CACHE_KB     - PRAGMA cache_size, КБ на соединение
+#   DB_BUSY_TIMEOUT - PRAGMA busy_timeout, мс
+########################################
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 16))
+DB_MMAP_SIZE = int(os.environ.get('DB_MMAP_SIZE', 256 * 1024 * 1024))
+DB_CACHE_KB = int(os.environ.get('DB_CACHE_KB', 16 * 1024))
+DB_BUSY_TIMEOUT = int(os.environ.get('DB_BUSY_TIMEOUT', 5000))
+
+class PooledCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        return run_blocking(super().execute, *args)
+
+    def executemany(self, *args):
+        return run_blocking(super().executemany, *args)
+
+class PooledConnection(sqlite3.Connection):
+    # close() не закрывает соединение, а возвращает его в пул;
+    # незавершённая транзакция при этом откатывается
+    pool = None
+
+    def cursor(self, factory=PooledCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return run_blocking(super().execute, *args)
+
+    def executemany(self, *args):
+        return run_blocking(super().executemany, *args)
+
+    def commit(self):
+        return run_blocking(super().commit)
+
+    def rollback(self):
+        return run_blocking(super().rollback)
+
+    def close(self):
+        if self.pool is None:
+            return super().close()
+        if self.in_transaction:
+            self.rollback()
+        self.pool.release(self)
+
+    def really_close(self):
+        super().close()
+
+class ConnectionPool:
+    def __init__(self, database: str, size: int = DB_POOL_SIZE):
+        self.database = database
+        self.idle = queue.LifoQueue(maxsize=size)
+        self.stats = {'created': 0, 'reused': 0}
+
+    def connect(self) -> PooledConnection:
+        # check_same_thread=False: соединение может достаться другому потоку,
+        # но одновременно им пользуется только тот, кто взял его из пула
+        conn = sqlite3.connect(self.database, factory=PooledConnection, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+        conn.pool = self
+        self.stats['created'] += 1
+        return conn
+
+    def get(self) -> PooledConnection:
+        try:
+            conn = self.idle.get_nowait()
+            self.stats['reused'] += 1
+            return conn
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, conn: PooledConnection):
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.really_close()
+
+    def close_all(self):
+        while True:
+            try:
+                self.idle.get_nowait().really_close()
+            except queue.Empty:
+                return
@@ -0,0 +1,78 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+########################################
+# LRU-кэш распакованного текста сообщений по private_messages.id.
+# Размер ограничен суммарным объёмом строк в байтах (sys.getsizeof),
+# записи старше TTL считаются промахом. Кэш заполняется при отправке
+# и при загрузке истории, clear_chat удаляет сообщения чата из кэша.
+#
+# Настройки через переменные окружения:
+#   MESSAGE_CACHE_BYTES - максимальный объём кэша (0 - кэш выключен)
+#   MESSAGE_CACHE_TTL   - время жизни записи в секундах
+########################################
+MESSAGE_CACHE_BYTES = int(os.environ.get('MESSAGE_CACHE_BYTES', 32 * 1024 * 1024))
+MESSAGE_CACHE_TTL = float(os.environ.get('MESSAGE_CACHE_TTL', 600))
+
+class MessageCache:
+    def __init__(self, max_bytes: int = MESSAGE_CACHE_BYTES, ttl: float = MESSAGE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # id -> (текст, размер, время записи)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+
+    def get(self, message_id: int):
+        with self.lock:
+            entry = self.entries.get(message_id)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            text, size, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                self.remove(message_id)
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(message_id)
+            self.stats['hits'] += 1
+            return text
+
+    def put(self, message_id: int, text: str):
+        size = sys.getsizeof(text)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self.remove(message_id)
+            self.entries[message_id] = (text, size, time.monotonic())
+            self.size += size
+            while self.size > self.max_bytes:
+                oldest_id = next(iter(self.entries))
+                self.remove(oldest_id)
+                self.stats['evictions'] += 1
+
+    def remove(self, message_id: int):
+        # Вызывается под self.lock
+        entry = self.entries.pop(message_id, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def invalidate(self, message_ids):
+        with self.lock:
+            for message_id in message_ids:
+                self.remove(message_id)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def info(self) -> dict:
+        with self.lock:
+            return dict(self.stats, entries=len(self.entries), bytes=self.size, max_bytes=self.max_bytes)
+
+cache = MessageCache()
@@ -0,0 +1,170 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+########################################
+# Групповая запись сообщений. Обработчики Socket.IO кладут строки
+# в очередь и ждут Future; фоновый поток собирает пачку (до
+# MESSAGE_BATCH_ROWS строк или MESSAGE_FLUSH_MS мс с первой строки)
+# и пишет её одним executemany в одной транзакции - один commit
+# вместо commit на каждое сообщение. Future получает id строки только
+# после commit, поэтому отправитель узнаёт о сообщении, когда оно уже в базе.
+# При MESSAGE_SYNC=FULL (по умолчанию) commit дожидается fsync журнала WAL,
+# и подтверждённое сообщение переживает и падение процесса, и отключение
+# питания. При NORMAL подтверждение гарантирует только переживание падения
+# процесса: последние commit до checkpoint могут пропасть при сбое ОС или питания.
+# followups - дополнительные запросы, выполняемые в той же транзакции
+# после основной вставки (например, обновление сводки conversations);
+# параметры для них передаются в submit() вместе со строкой.
+# Ошибка записи (в том числе при открытии соединения или rollback)
+# отдаётся всем Future пачки, соединение выбрасывается, а поток
+# продолжает работу со следующей пачкой на новом соединении.
+#
+# Настройки через переменные окружения:
+#   MESSAGE_BATCH_ROWS - максимум строк в пачке (1 - писать по одной)
+#   MESSAGE_FLUSH_MS   - сколько ждать добора пачки после первой строки;
+#                        0 - брать только то, что накопилось, пока шёл
+#                        предыдущий commit (пачки складываются сами под нагрузкой,
+#                        а одиночное сообщение не ждёт)
+#   MESSAGE_SYNC       - PRAGMA synchronous соединения писателя:
+#                        FULL - fsync на каждый commit (по умолчанию; переживает
+#                               отключение питания),
+#                        NORMAL - fsync при checkpoint WAL (переживает только
+#                                 падение процесса, не ОС и не питания),
+#                        OFF - без fsync
+########################################
+MESSAGE_BATCH_ROWS = int(os.environ.get('MESSAGE_BATCH_ROWS', 100))
+MESSAGE_FLUSH_MS = float(os.environ.get('MESSAGE_FLUSH_MS', 0))
+MESSAGE_SYNC = os.environ.get('MESSAGE_SYNC', 'FULL').upper()
+MESSAGE_ACK_TIMEOUT = float(os.environ.get('MESSAGE_ACK_TIMEOUT', 10))
+
+class MessageWriter:
+    def __init__(self, get_connection, sql: str, batch_rows: int = MESSAGE_BATCH_ROWS,
+                 flush_ms: float = MESSAGE_FLUSH_MS, sync: str = MESSAGE_SYNC, followups: tuple = ()):
+        if sync not in ('FULL', 'NORMAL', 'OFF'):
+            raise ValueError(f"Неизвестный режим synchronous: {sync}")
+        self.get_connection = get_connection
+        self.sql = sql
+        self.followups = followups
+        self.batch_rows = max(1, batch_rows)
+        self.flush_ms = flush_ms
+        self.sync = sync
+        self.pending = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {'rows': 0, 'batches': 0, 'errors': 0}
+
+    def start(self):
+        with self.lock:
+            # Поток мог завершиться аварийно - тогда запускаем новый
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='message-writer', daemon=True)
+                self.thread.start()
+
+    def submit(self, params: tuple, followup_params: tuple = ()) -> Future:
+        # followup_params[i] - список строк параметров для followups[i]
+        self.start()
+        future = Future()
+        self.pending.put((params, followup_params, future))
+        return future
+
+    def write(self, params: tuple, followup_params: tuple = (), timeout: float = MESSAGE_ACK_TIMEOUT) -> int:
+        # Блокирует до commit пачки, возвращает id строки
+        return self.submit(params, followup_params).result(timeout=timeout)
+
+    def collect(self) -> list:
+        # Первая строка - блокирующе, остальные - пока не наберётся пачка
+        # или не выйдет время ожидания
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.flush_ms / 1000
+        while len(batch) < self.batch_rows:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def open_connection(self):
+        # Соединение может быть из пула: режим synchronous возвращаем при выходе
+        conn = self.get_connection()
+        try:
+            previous_sync = conn.execute("PRAGMA synchronous").fetchone()[0]
+            conn.execute(f"PRAGMA synchronous={self.sync}")
+        except Exception:
+            self.discard(conn)
+            raise
+        return conn, previous_sync
+
+    def discard(self, conn):
+        # Соединение после ошибки в пул не возвращаем: оно может быть в
+        # непонятном состоянии (незакрытая транзакция, другой synchronous)
+        if conn is None:
+            return
+        try:
+            getattr(conn, 'really_close', conn.close)()
+        except Exception as e:
+            print(f"Ошибка закрытия соединения писателя: {e}")
+
+    def run(self):
+        conn = None
+        while True:
+            batch = self.collect()
+            stop = any(item is None for item in batch)
+            batch = [item for item in batch if item is not None]
+            try:
+                if batch and conn is None:
+                    conn, previous_sync = self.open_connection()
+                self.flush(conn, batch)
+            except Exception as e:
+                print(f"Ошибка записи пачки сообщений: {e}")
+                self.stats['errors'] += 1
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                self.discard(conn)
+                conn = None
+            if stop:
+                break
+        if conn is not None:
+            try:
+                conn.execute(f"PRAGMA synchronous={previous_sync}")
+                conn.close()
+            except Exception:
+                self.discard(conn)
+
+    def flush(self, conn, batch: list):
+        # Исключение уходит в run(): там Future пачки получают ошибку
+        if not batch:
+            return
+        try:
+            conn.executemany(self.sql, [params for params, _, _ in batch])
+            # В одной транзакции AUTOINCREMENT выдаёт id подряд,
+            # поэтому id пачки восстанавливаются по последнему
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            for index, sql in enumerate(self.followups):
+                rows = [row for _, followup_params, _ in batch if followup_params for row in followup_params[index]]
+                if rows:
+                    conn.executemany(sql, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self.stats['rows'] += len(batch)
+        self.stats['batches'] += 1
+        first_id = last_id - len(batch) + 1
+        for offset, (_, _, future) in enumerate(batch):
+            future.set_result(first_id + offset)
+
+    def close(self):
+        # Дописывает всё, что уже в очереди, и останавливает поток
+        with self.lock:
+            if self.thread is None:
+                return
+            if self.thread.is_alive():
+                self.pending.put(None)
+                self.thread.join()
+            self.thread = None
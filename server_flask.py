@@ -1,4 +1,10 @@
+# Режим eventlet/gevent требует monkey patching до остальных импортов
+import async_support
+async_support.patch()
+from async_support import ASYNC_MODE, run_blocking
+
 import os
+import atexit
 import uuid
 import time
 import sqlite3
@@ -8,15 +14,30 @@ from flask import Flask, render_template, request, redirect, url_for, session, f
 from flask_socketio import SocketIO, emit, join_room
 from werkzeug.utils import secure_filename
 import compression  # Использует ваш compression.py для текстов
+from compression_service import service as compression_service, CompressionBusy, timed
+from message_cache import cache as message_cache
+from db_pool import ConnectionPool
+from message_writer import MessageWriter, MESSAGE_ACK_TIMEOUT
+from sqlite_queue import SQLiteManager
 from PIL import Image
 import io
 import zlib
 import ffmpeg
 import tempfile
+from concurrent.futures import TimeoutError
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key'
-socketio = SocketIO(app)
+# Очередь сообщений для нескольких процессов сервера (за балансировщиком
+# со sticky-сессиями): без неё emit в комнату доходит только до клиентов
+# своего процесса. SOCKETIO_MESSAGE_QUEUE=redis://... или amqp://... -
+# штатные менеджеры Flask-SocketIO, sqlite:///файл.db - локальная очередь
+# из sqlite_queue.py для одной машины и тестов.
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+if SOCKETIO_MESSAGE_QUEUE and SOCKETIO_MESSAGE_QUEUE.startswith('sqlite://'):
+    socketio = SocketIO(app, async_mode=ASYNC_MODE, client_manager=SQLiteManager(SOCKETIO_MESSAGE_QUEUE))
+else:
+    socketio = SocketIO(app, async_mode=ASYNC_MODE, message_queue=SOCKETIO_MESSAGE_QUEUE)
 
 DATABASE = 'database.db'
 
@@ -35,9 +56,30 @@ for folder in [UPLOAD_FOLDER, COMPRESSED_UPLOAD_FOLDER]:
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Версия формата conversation_id в PRAGMA user_version
+CONVERSATION_KEY_VERSION = 1
+
+# Сколько секунд процесс ждёт, пока миграцию выполняет другой процесс
+MIGRATION_TIMEOUT = float(os.environ.get('MIGRATION_TIMEOUT', 300))
+
 def init_db():
-    conn = sqlite3.connect(DATABASE)
+    # Миграция целиком в одной транзакции BEGIN IMMEDIATE: при запуске
+    # нескольких процессов сервера (SOCKETIO_MESSAGE_QUEUE) первый берёт
+    # блокировку записи, остальные ждут и уже видят готовую схему, поэтому
+    # ALTER TABLE не выполняется дважды ("duplicate column name")
+    conn = sqlite3.connect(DATABASE, timeout=MIGRATION_TIMEOUT, isolation_level=None)
     c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        migrate_db(c)
+    except BaseException:
+        c.execute("ROLLBACK")
+        conn.close()
+        raise
+    c.execute("COMMIT")
+    conn.close()
+
+def migrate_db(c):
     c.execute('''
         CREATE TABLE IF NOT EXISTS users (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -66,15 +108,135 @@ def init_db():
             date_created REAL
         )
     ''')
-    conn.commit()
-    conn.close()
+    # Замеры сжатия: исходный размер, фактический кодек и время
+    # (настенное и процессорное, в мс). Старые базы догоняем через ALTER TABLE.
+    add_missing_columns(c, 'private_messages', {
+        'original_size': 'INTEGER',
+        'codec': 'TEXT',
+        'compress_ms': 'REAL',
+        'compress_cpu_ms': 'REAL',
+        'decompress_ms': 'REAL',
+        'decompress_cpu_ms': 'REAL',
+        'conversation_id': 'TEXT',
+    })
+    # conversation_id - упорядоченная пара собеседников (см. conversation_id()),
+    # чтобы выборки по чату шли по индексу, а не через OR по sender/receiver.
+    # Базы с user_version < 1 хранят ключ старого вида "a\x1fb", который
+    # совпадал у разных пар, - пересчитываем его для всех строк
+    schema_version = c.execute("PRAGMA user_version").fetchone()[0]
+    c.execute(f'''
+        UPDATE private_messages
+        SET conversation_id = CASE WHEN sender <= receiver
+                                   THEN length(sender) || ':' || sender || receiver
+                                   ELSE length(receiver) || ':' || receiver || sender END
+        WHERE conversation_id IS NULL OR {schema_version} < {CONVERSATION_KEY_VERSION}
+    ''')
+    c.execute(f"PRAGMA user_version = {max(schema_version, CONVERSATION_KEY_VERSION)}")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_private_messages_conversation ON private_messages (conversation_id, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_private_messages_sender ON private_messages (sender)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_private_messages_receiver ON private_messages (receiver)")
+    add_missing_columns(c, 'file_stats', {
+        'compress_ms': 'REAL',
+        'compress_cpu_ms': 'REAL',
+        'decompress_ms': 'REAL',
+        'decompress_cpu_ms': 'REAL',
+    })
+    # Сводка чатов для боковой панели: строка на каждого участника переписки.
+    # Обновляется в той же транзакции, что и вставка сообщения (message_writer)
+    # и очистка чата, поэтому список чатов - один проход по индексу (user, last_ts).
+    conversations_exist = c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversations'").fetchone()
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS conversations (
+            user TEXT,
+            partner TEXT,
+            last_ts REAL,
+            last_message_preview TEXT,
+            unread_count INTEGER DEFAULT 0,
+            PRIMARY KEY (user, partner)
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_conversations_user_ts ON conversations (user, last_ts)")
+    if not conversations_exist:
+        backfill_conversations(c)
+
+def backfill_conversations(c):
+    # Заполняем сводку по последнему сообщению каждой переписки
+    # (превью приходится распаковать, непрочитанных считаем 0)
+    rows = c.execute('''
+        SELECT p.sender, p.receiver, p.timestamp, p.compressed_message
+        FROM private_messages p
+        JOIN (SELECT MAX(id) AS id FROM private_messages GROUP BY conversation_id) last ON p.id = last.id
+    ''').fetchall()
+    for sender, receiver, timestamp, comp in rows:
+        try:
+            preview = message_preview(compression.decompress(comp).decode('utf-8', errors='replace'))
+        except Exception as e:
+            print(f"Ошибка декомпрессии при заполнении conversations: {e}")
+            preview = None
+        c.executemany(CONVERSATION_UPSERT_SQL, conversation_rows(sender, receiver, timestamp, preview, unread=0))
+    print(f"Сводка conversations заполнена: {len(rows)} переписок")
+
+PREVIEW_LENGTH = 100
+
+CONVERSATION_UPSERT_SQL = '''
+    INSERT INTO conversations (user, partner, last_ts, last_message_preview, unread_count)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (user, partner) DO UPDATE SET
+        last_message_preview = CASE WHEN excluded.last_ts >= last_ts
+                                    THEN excluded.last_message_preview ELSE last_message_preview END,
+        last_ts = MAX(last_ts, excluded.last_ts),
+        unread_count = unread_count + excluded.unread_count
+'''
+
+def message_preview(text):
+    # FILE:type:url показываем как [type], остальное обрезаем
+    if text.startswith('FILE:'):
+        return f"[{text.split(':', 2)[1]}]"
+    return text[:PREVIEW_LENGTH]
+
+def conversation_rows(sender, receiver, timestamp, preview, unread=1):
+    # Строки для CONVERSATION_UPSERT_SQL: у отправителя непрочитанных не прибавляется,
+    # переписка с самим собой (избранное) - одна строка
+    rows = [(sender, receiver, timestamp, preview, 0)]
+    if receiver != sender:
+        rows.append((receiver, sender, timestamp, preview, unread))
+    return rows
+
+def conversation_id(user1, user2):
+    # Тот же ключ, что и в SQL-миграции: строки сравниваются побайтно,
+    # перед первым именем - его длина, поэтому ключ однозначно делится
+    # на два имени и разные пары не совпадают, какие бы символы в них ни были
+    first, second = sorted((user1, user2))
+    return f"{len(first)}:{first}{second}"
+
+def valid_username(username):
+    # Управляющие символы в логине не нужны и ломают отображение
+    return bool(username) and not any(ch < ' ' or ch == '\x7f' for ch in username)
+
+def add_missing_columns(c, table, columns):
+    existing = {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+    for name, column_type in columns.items():
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
 
 init_db()
 
+# Соединения берутся из пула (WAL, настроенные PRAGMA); conn.close()
+# возвращает соединение в пул, поэтому вызывающий код не меняется
+db_pool = ConnectionPool(DATABASE)
+
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return db_pool.get()
+
+# Сообщения пишутся пачками фоновым писателем (см. message_writer.py)
+# вместе со сводкой conversations в той же транзакции
+message_writer = MessageWriter(get_db_connection, """
+    INSERT INTO private_messages (sender, receiver, conversation_id, timestamp, compressed_message,
+                                  original_size, codec, compress_ms, compress_cpu_ms)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+""", followups=(CONVERSATION_UPSERT_SQL,))
+atexit.register(message_writer.close)
 
 @app.route('/')
 def index():
@@ -110,6 +272,9 @@ def register():
         username = request.form['username']
         email = request.form['email']
         password = request.form['password']
+        if not valid_username(username):
+            flash('Логин не должен быть пустым или содержать управляющие символы', 'danger')
+            return render_template('register.html')
         conn = get_db_connection()
         try:
             conn.execute('INSERT INTO users (name, username, email, password) VALUES (?, ?, ?, ?)',
@@ -156,29 +321,26 @@ def api_private_chats():
         return jsonify({"error": "Unauthorized"}), 401
     username = session['username']
     conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('''
-        SELECT 
-            CASE WHEN sender = ? THEN receiver ELSE sender END AS partner,
-            MAX(timestamp) as last_ts
-        FROM private_messages
-        WHERE sender = ? OR receiver = ?
-        GROUP BY partner
+    chats = conn.execute('''
+        SELECT partner, last_ts, last_message_preview, unread_count
+        FROM conversations
+        WHERE user = ?
         ORDER BY last_ts DESC
-    ''', (username, username, username))
-    chats = c.fetchall()
+    ''', (username,)).fetchall()
     conn.close()
     chat_list = []
     for chat in chats:
         partner = chat["partner"]
-        last_ts = chat["last_ts"]
         label = "Избранное" if partner == username else partner
-        chat_list.append({"partner": partner, "last_ts": last_ts, "label": label})
+        chat_list.append({"partner": partner, "last_ts": chat["last_ts"], "label": label,
+                          "preview": chat["last_message_preview"], "unread": chat["unread_count"]})
     if not any(item["partner"] == username for item in chat_list):
-        chat_list.append({"partner": username, "last_ts": 0, "label": "Избранное"})
+        chat_list.append({"partner": username, "last_ts": 0, "label": "Избранное", "preview": None, "unread": 0})
     chat_list.sort(key=lambda x: x["last_ts"], reverse=True)
     return jsonify({"chats": chat_list})
 
+CLEAR_CHAT_SQL = "DELETE FROM private_messages WHERE conversation_id = ?"
+
 @app.route('/api/clear_chat', methods=['POST'])
 def clear_chat():
     if 'username' not in session:
@@ -196,24 +358,22 @@ def clear_chat():
     try:
         conn = get_db_connection()
         
-        # Удаляем сообщения между пользователями
+        # Удаляем сообщения между пользователями (для избранного пара - сам с собой)
+        conversation = conversation_id(username, chat_partner)
+        deleted_ids = [row['id'] for row in conn.execute(
+            "SELECT id FROM private_messages WHERE conversation_id = ?", (conversation,))]
+        conn.execute(CLEAR_CHAT_SQL, (conversation,))
+        deleted_count = conn.execute("SELECT changes()").fetchone()[0]
+        conn.execute("DELETE FROM conversations WHERE (user = ? AND partner = ?) OR (user = ? AND partner = ?)",
+                     (username, chat_partner, chat_partner, username))
         if chat_partner == username:
-            # В случае с избранным, удаляем сообщения, отправленные самому себе
-            conn.execute("DELETE FROM private_messages WHERE sender = ? AND receiver = ?", 
-                       (username, username))
-            deleted_count = conn.execute("SELECT changes()").fetchone()[0]
             print(f"Удалено {deleted_count} сообщений из избранного пользователя {username}")
         else:
-            # Удаляем все сообщения между текущим пользователем и выбранным собеседником
-            conn.execute("""
-                DELETE FROM private_messages 
-                WHERE (sender = ? AND receiver = ?) OR (sender = ? AND receiver = ?)
-            """, (username, chat_partner, chat_partner, username))
-            deleted_count = conn.execute("SELECT changes()").fetchone()[0]
             print(f"Удалено {deleted_count} сообщений между {username} и {chat_partner}")
         
         conn.commit()
         conn.close()
+        message_cache.invalidate(deleted_ids)
         
         return jsonify({
             "success": True, 
@@ -254,6 +414,16 @@ def reset_stats():
         return jsonify({"error": f"Ошибка при сбросе статистики: {str(e)}"}), 500
 
 # --- Вспомогательные функции для конвертации ---
+# (вызываются через run_blocking: в режимах eventlet/gevent - в потоке ОС)
+def compress_image(input_bytes):
+    image = Image.open(io.BytesIO(input_bytes))
+    image = image.convert("RGB")
+    max_size = 1024
+    image.thumbnail((max_size, max_size))
+    out_io = io.BytesIO()
+    image.save(out_io, format="JPEG", quality=75)
+    return out_io.getvalue()
+
 def convert_audio_to_ogg(input_bytes):
     with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as in_file:
         in_file.write(input_bytes)
@@ -286,6 +456,43 @@ def convert_video_to_webm(input_bytes):
             webm_bytes = f.read()
     return webm_bytes
 
+def is_media_upload(file_type, ext):
+    # Ветки /upload, которым нужен весь файл в памяти: PIL и ffmpeg
+    return file_type in ("image", "video", "voice") or (file_type == "audio" and ext == 'mp3')
+
+class CountingReader:
+    # Обёртка над потоком загрузки: считает прочитанные байты и их CRC32
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+        self.crc = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.size += len(chunk)
+        self.crc = zlib.crc32(chunk, self.crc)
+        return chunk
+
+def compress_upload(stream, save_path, codec):
+    # Потоковое сжатие загрузки в файл с маркером C -> (исходный размер, CRC32)
+    source = CountingReader(stream)
+    with open(save_path, "wb") as f_out:
+        f_out.write(b'C')
+        compression.compress_stream(source, f_out, codec=codec)
+    return source.size, source.crc
+
+def upload_crc(save_path):
+    # CRC32 распакованного файла с маркером C, тоже поблочно
+    crc = 0
+    with open(save_path, "rb") as f_in:
+        f_in.read(1)
+        with compression.DecompressReader(f_in) as reader:
+            while True:
+                chunk = reader.read(compression.BLOCK_SIZE)
+                if not chunk:
+                    return crc
+                crc = zlib.crc32(chunk, crc)
+
 @app.route('/upload', methods=['POST'])
 def upload():
     if 'username' not in session:
@@ -301,22 +508,25 @@ def upload():
 
     if file and allowed_file(file.filename):
         try:
-            file_data = file.read()
-            original_size = len(file_data)
-            print(f"Исходный размер файла: {original_size} байт ({original_size/1024:.2f} КБ)")
             ext_original = file.filename.rsplit('.', 1)[1].lower()
+            # Целиком в память читаются только медиафайлы (PIL и ffmpeg работают с байтами);
+            # остальные сжимаются и сохраняются потоком, поблочно
+            if file_mode == 'compressed' and is_media_upload(file_type, ext_original):
+                file_data = file.read()
+                original_size = len(file_data)
+                print(f"Исходный размер файла: {original_size} байт ({original_size/1024:.2f} КБ)")
 
             if file_mode == 'compressed':
+                # Время сжатия возвращают timed()/compression_service из потока,
+                # где шла работа; для веток без сжатия меряем всю ветку
+                wall_start = time.perf_counter()
+                cpu_start = time.thread_time()
+                compress_ms = compress_cpu_ms = None
+                decompress_ms = decompress_cpu_ms = 0.0
                 if file_type == "image":
                     # Сжимаем изображение через PIL, сохраняем как JPEG
                     try:
-                        image = Image.open(io.BytesIO(file_data))
-                        image = image.convert("RGB")
-                        max_size = 1024
-                        image.thumbnail((max_size, max_size))
-                        out_io = io.BytesIO()
-                        image.save(out_io, format="JPEG", quality=75)
-                        recompressed_data = out_io.getvalue()
+                        recompressed_data, compress_ms, compress_cpu_ms = run_blocking(timed, compress_image, file_data)
                         print(f"Размер после PIL-компрессии: {len(recompressed_data)} байт ({len(recompressed_data)/1024:.2f} КБ)")
                         compression_ratio = (1 - len(recompressed_data) / original_size) * 100 if original_size > 0 else 0
                         print(f"Степень сжатия: {compression_ratio:.2f}% (экономия {original_size - len(recompressed_data)} байт)")
@@ -337,7 +547,7 @@ def upload():
                     # Конвертация MP3 в OGG
                     print(f"Попытка конвертации MP3 в OGG для файла: {file.filename}")
                     try:
-                        ogg_data = convert_audio_to_ogg(file_data)
+                        ogg_data, compress_ms, compress_cpu_ms = run_blocking(timed, convert_audio_to_ogg, file_data)
                         print("Конвертация в OGG успешна.")
                         final_data = b'O' + ogg_data
                         ext_final = 'ogg'
@@ -356,7 +566,7 @@ def upload():
                 elif file_type == "video" and ext_original == 'mp4':
                     # Конвертация MP4 в WebM
                     try:
-                        webm_data = convert_video_to_webm(file_data)
+                        webm_data, compress_ms, compress_cpu_ms = run_blocking(timed, convert_video_to_webm, file_data)
                         final_data = b'O' + webm_data
                         ext_final = 'webm'
                         comp_type = "MP4->WebM"
@@ -380,35 +590,60 @@ def upload():
                     comp_type = "Original"
                     print(f"Сохраняем оригинальное медиа, размер: {compressed_size} байт ({compressed_size/1024:.2f} КБ)")
                 else:
-                    # Для прочих файлов - zlib
-                    z_data = zlib.compress(file_data)
-                    compressed_size = len(z_data)
+                    # Для прочих файлов - самый быстрый из доступных кодеков compression
+                    # (zstd/lz4, если установлены, иначе zlib), маркер C.
+                    # Файл сжимается потоком блоками по BLOCK_SIZE прямо в итоговый файл:
+                    # в памяти не больше блока, исходный размер - число прочитанных байт
+                    codec = compression.preferred_codec()
+                    ext_final = ext_original
+                    unique_filename = f"{uuid.uuid4().hex}.{ext_final}"
+                    save_path = os.path.join(app.config['COMPRESSED_UPLOAD_FOLDER'], unique_filename)
+                    (original_size, original_crc), compress_ms, compress_cpu_ms = run_blocking(
+                        timed, compress_upload, file.stream, save_path, codec)
+                    print(f"Исходный размер файла: {original_size} байт ({original_size/1024:.2f} КБ)")
+                    compressed_size = os.path.getsize(save_path) - 1
                     compression_ratio = (1 - compressed_size / original_size) * 100 if original_size > 0 else 0
+                    final_data = None
                     
                     if compressed_size < original_size:
-                        final_data = b'Z' + z_data
-                        print(f"Размер после zlib: {compressed_size} байт ({compressed_size/1024:.2f} КБ)")
+                        # Распаковку меряем выборочно (доля COMPRESS_VERIFY_RATE, как проверку
+                        # сообщений): полная распаковка каждого файла удвоила бы цену загрузки
+                        decompress_ms = decompress_cpu_ms = None
+                        if compression_service.should_verify():
+                            decoded_crc, decompress_ms, decompress_cpu_ms = run_blocking(timed, upload_crc, save_path)
+                            if decoded_crc != original_crc:
+                                print(f"ОШИБКА ПРОВЕРКИ: файл не распаковался в исходные данные")
+                        print(f"Размер после {codec}: {compressed_size} байт ({compressed_size/1024:.2f} КБ)")
                         print(f"Степень сжатия: {compression_ratio:.2f}% (экономия {original_size - compressed_size} байт)")
-                        comp_type = "zlib"
+                        comp_type = codec
                     else:
-                        final_data = b'O' + file_data
+                        # Сжатие не выиграло: перезаписываем файл оригиналом, снова потоком
+                        file.stream.seek(0)
+                        with open(save_path, "wb") as f_out:
+                            f_out.write(b'O')
+                            shutil.copyfileobj(file.stream, f_out, compression.BLOCK_SIZE)
                         compression_ratio = 0
                         comp_type = "Original"
-                        print("zlib не дал выигрыш, сохраняем оригинал")
-                    # Оставляем расширение
-                    ext_final = ext_original
+                        print(f"{codec} не дал выигрыш, сохраняем оригинал")
+                # P и O отдаются срезом без распаковки, поэтому decompress_ms у них 0
+                if compress_ms is None:
+                    compress_ms = (time.perf_counter() - wall_start) * 1000
+                    compress_cpu_ms = (time.thread_time() - cpu_start) * 1000
+                print(f"Время сжатия: {compress_ms:.2f} мс (CPU {compress_cpu_ms:.2f} мс), распаковки: "
+                      f"{'не замерялось' if decompress_ms is None else f'{decompress_ms:.2f} мс'}")
 
-                # Формируем уникальное имя для файла
-                unique_filename = f"{uuid.uuid4().hex}.{ext_final}"
-                save_path = os.path.join(app.config['COMPRESSED_UPLOAD_FOLDER'], unique_filename)
-                with open(save_path, "wb") as f_out:
-                    f_out.write(final_data)
+                # Формируем уникальное имя для файла (потоковая ветка уже записала файл)
+                if final_data is not None:
+                    unique_filename = f"{uuid.uuid4().hex}.{ext_final}"
+                    save_path = os.path.join(app.config['COMPRESSED_UPLOAD_FOLDER'], unique_filename)
+                    with open(save_path, "wb") as f_out:
+                        f_out.write(final_data)
                 
                 print(f"Файл сохранён по пути: {save_path}")
                 print(f"Расширение файла: {ext_final}")
                 
                 # Финальный размер с учетом заголовка
-                final_size = len(final_data)
+                final_size = os.path.getsize(save_path)
                 actual_compression_ratio = (1 - final_size / original_size) * 100 if original_size > 0 else 0
                 print(f"Финальный размер: {final_size} байт ({final_size/1024:.2f} КБ)")
                 print(f"Итоговое сжатие: {actual_compression_ratio:.2f}%")
@@ -420,10 +655,12 @@ def upload():
                 # Сохраняем статистику файла в базу данных
                 try:
                     conn = get_db_connection()
-                    conn.execute(
-                        "INSERT INTO file_stats (filename, original_size, compressed_size, compression_type, date_created) VALUES (?, ?, ?, ?, ?)",
-                        (unique_filename, original_size, final_size, comp_type, time.time())
-                    )
+                    conn.execute("""
+                        INSERT INTO file_stats (filename, original_size, compressed_size, compression_type, date_created,
+                                                compress_ms, compress_cpu_ms, decompress_ms, decompress_cpu_ms)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (unique_filename, original_size, final_size, comp_type, time.time(),
+                          compress_ms, compress_cpu_ms, decompress_ms, decompress_cpu_ms))
                     conn.commit()
                     conn.close()
                     print(f"Статистика сжатия файла {unique_filename} сохранена в базу данных")
@@ -434,14 +671,15 @@ def upload():
                 # Режим document - без изменений
                 unique_filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
                 save_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                with open(save_path, "wb") as f_out:
-                    f_out.write(file_data)
+                run_blocking(file.save, save_path, compression.BLOCK_SIZE)
+                original_size = os.path.getsize(save_path)
                     
                 print(f"Файл документа сохранён по пути: {save_path}")
                 file_url = url_for('static', filename=f'uploads/{unique_filename}')
                 print(f"URL для документа: {file_url}")
                 final_size = original_size
                 actual_compression_ratio = 0
+                ext_final = ext_original
 
             # Возвращаем информацию о загруженном файле
             return jsonify({
@@ -454,6 +692,9 @@ def upload():
                 "compressed_size": final_size,
                 "compression_ratio": actual_compression_ratio
             })
+        except CompressionBusy as e:
+            print(f"Сервер сжатия перегружен: {e}")
+            return jsonify({"error": "Сервер перегружен, попробуйте загрузить файл позже"}), 503, {'Retry-After': '5'}
         except Exception as e:
             print("Ошибка при загрузке файла:")
             traceback.print_exc()
@@ -486,12 +727,12 @@ def serve_compressed_file(filename):
                 # PIL JPEG
                 content = payload
                 mimetype = 'image/jpeg'
-            elif header == b'Z':
-                # zlib
+            elif header == b'Z' or header == b'C':
+                # Z - zlib (старые файлы), C - кадр compression с флагом кодека
                 try:
-                    content = zlib.decompress(payload)
+                    content = run_blocking(zlib.decompress if header == b'Z' else compression.decompress, payload)
                 except Exception as e:
-                    print(f"Ошибка декомпрессии zlib: {e}")
+                    print(f"Ошибка декомпрессии: {e}")
                     return "Ошибка декомпрессии", 500
                 
                 # Определяем MIME-тип по расширению файла
@@ -690,6 +931,26 @@ def handle_join_private(data):
     join_room(room)
     print(f"Пользователь присоединился к комнате: {room}")
 
+def verify_message(message_id, raw_msg, compressed_msg):
+    # Выборочная проверка записи в фоне; заодно записываем время распаковки
+    try:
+        ok, decompress_ms, decompress_cpu_ms = compression_service.verify(raw_msg, compressed_msg)
+    except CompressionBusy:
+        print(f"Проверка сообщения {message_id} пропущена: сервер сжатия перегружен")
+        return
+    if not ok:
+        print(f"ОШИБКА: сообщение {message_id} ({compression.frame_codec(compressed_msg)}) распаковывается не в исходный текст")
+        return
+    conn = get_db_connection()
+    conn.execute("UPDATE private_messages SET decompress_ms = ?, decompress_cpu_ms = ? WHERE id = ?",
+                 (decompress_ms, decompress_cpu_ms, message_id))
+    conn.commit()
+    conn.close()
+
+def schedule_verify(message_id, raw_msg, compressed_msg):
+    if compression_service.should_verify():
+        socketio.start_background_task(verify_message, message_id, raw_msg, compressed_msg)
+
 @socketio.on('send_private_message')
 def handle_send_private_message(data):
     if 'username' not in session:
@@ -704,37 +965,44 @@ def handle_send_private_message(data):
     
     print(f"Отправка сообщения от {sender} к {receiver} в комнату {room}: {message[:30]}...")
     
+    raw_msg = message.encode('utf-8')
     try:
-        compressed_msg = compression.compress(message.encode('utf-8'), use_bwt=True)
+        compressed_msg, compress_ms, compress_cpu_ms = compression_service.compress(raw_msg, codec='auto')
         print(f"Сообщение сжато, размер: {len(compressed_msg)} байт")
+    except CompressionBusy as e:
+        print(f"Сервер сжатия перегружен: {e}")
+        emit('server_busy', {'error': 'Сервер перегружен, попробуйте отправить сообщение позже', 'message': message})
+        return
     except Exception as e:
         print(f"Ошибка сжатия сообщения: {e}")
         traceback.print_exc()
         return
     
     try:
-        conn = get_db_connection()
-        conn.execute("INSERT INTO private_messages (sender, receiver, timestamp, compressed_message) VALUES (?, ?, ?, ?)",
-                    (sender, receiver, timestamp, compressed_msg))
-        conn.commit()
-        conn.close()
+        # Ждём commit пачки: подтверждение уходит, только когда сообщение в базе
+        message_id = message_writer.write((sender, receiver, conversation_id(sender, receiver), timestamp,
+                                           compressed_msg, len(raw_msg), compression.frame_codec(compressed_msg),
+                                           compress_ms, compress_cpu_ms),
+                                          (conversation_rows(sender, receiver, timestamp, message_preview(message)),))
         print(f"Сообщение сохранено в базе данных")
+    except TimeoutError:
+        # Писатель не подтвердил commit вовремя - отправитель должен об этом узнать
+        print(f"Запись сообщения не подтверждена за {MESSAGE_ACK_TIMEOUT} с")
+        emit('server_busy', {'error': 'Сервер не успел сохранить сообщение, попробуйте позже', 'message': message})
+        return
     except Exception as e:
         print(f"Ошибка сохранения сообщения в базе данных: {e}")
         traceback.print_exc()
+        emit('message_failed', {'error': 'Не удалось сохранить сообщение', 'message': message})
         return
     
-    try:
-        decompressed_msg = compression.decompress(compressed_msg).decode('utf-8', errors='replace')
-        print(f"Сообщение декомпрессировано для отправки: {decompressed_msg[:30]}...")
-    except Exception as e:
-        print(f"Ошибка декомпрессии для отправки: {e}")
-        decompressed_msg = "[Ошибка декомпрессии]"
-    
+    # Рассылаем исходный текст: распаковывать только что сжатое незачем
     print(f"Отправка сообщения в комнату: {room}")
     socketio.emit('receive_private_message',
-                  {'sender': sender, 'message': decompressed_msg, 'timestamp': timestamp},
+                  {'sender': sender, 'message': message, 'timestamp': timestamp},
                   room=room)
+    message_cache.put(message_id, message)
+    schedule_verify(message_id, raw_msg, compressed_msg)
 
 @socketio.on('send_file_message')
 def handle_send_file_message(data):
@@ -758,42 +1026,99 @@ def handle_send_file_message(data):
     message_text = f"FILE:{file_type}:{file_url}"
     print(f"Текст сообщения: {message_text}")
     
+    raw_msg = message_text.encode('utf-8')
     try:
-        compressed_msg = compression.compress(message_text.encode('utf-8'), use_bwt=True)
+        compressed_msg, compress_ms, compress_cpu_ms = compression_service.compress(raw_msg, codec='auto')
         print(f"Сообщение с файлом сжато, размер: {len(compressed_msg)} байт")
+    except CompressionBusy as e:
+        print(f"Сервер сжатия перегружен: {e}")
+        emit('server_busy', {'error': 'Сервер перегружен, попробуйте отправить файл позже', 'message': message_text})
+        return
     except Exception as e:
         print(f"Ошибка сжатия сообщения с файлом: {e}")
         traceback.print_exc()
         return
     
     try:
-        conn = get_db_connection()
-        conn.execute("INSERT INTO private_messages (sender, receiver, timestamp, compressed_message) VALUES (?, ?, ?, ?)",
-                    (sender, receiver, timestamp, compressed_msg))
-        conn.commit()
-        conn.close()
+        # Ждём commit пачки: подтверждение уходит, только когда сообщение в базе
+        message_id = message_writer.write((sender, receiver, conversation_id(sender, receiver), timestamp,
+                                           compressed_msg, len(raw_msg), compression.frame_codec(compressed_msg),
+                                           compress_ms, compress_cpu_ms),
+                                          (conversation_rows(sender, receiver, timestamp, message_preview(message_text)),))
         print(f"Сообщение с файлом сохранено в базе данных")
+    except TimeoutError:
+        # Писатель не подтвердил commit вовремя - отправитель должен об этом узнать
+        print(f"Запись сообщения с файлом не подтверждена за {MESSAGE_ACK_TIMEOUT} с")
+        emit('server_busy', {'error': 'Сервер не успел сохранить файл, попробуйте позже', 'message': message_text})
+        return
     except Exception as e:
         print(f"Ошибка сохранения сообщения с файлом в базе данных: {e}")
         traceback.print_exc()
+        emit('message_failed', {'error': 'Не удалось сохранить файл', 'message': message_text})
         return
     
-    try:
-        decompressed_msg = compression.decompress(compressed_msg).decode('utf-8', errors='replace')
-        print(f"Сообщение с файлом декомпрессировано для отправки: {decompressed_msg}")
-    except Exception as e:
-        print(f"Ошибка декомпрессии для отправки файла: {e}")
-        decompressed_msg = "[Ошибка декомпрессии]"
-    
     print(f"Отправка сообщения с файлом в комнату: {room}")
     socketio.emit('receive_private_message',
-                  {'sender': sender, 'message': decompressed_msg, 'timestamp': timestamp},
+                  {'sender': sender, 'message': message_text, 'timestamp': timestamp},
                   room=room)
+    message_cache.put(message_id, message_text)
+    schedule_verify(message_id, raw_msg, compressed_msg)
+
+def decode_history(rows):
+    # None - сообщение не распаковалось
+    texts = []
+    for row in rows:
+        sender, receiver, comp = row['sender'], row['receiver'], row['compressed_message']
+        try:
+            print(f"Декомпрессия сообщения от {sender} для {receiver}, размер: {len(comp)} байт")
+            msg_text = str(compression.decompress_view(comp), 'utf-8', errors='replace')
+            print(f"Декомпрессированное сообщение: {msg_text[:50]}...")
+        except Exception as e:
+            print(f"Ошибка декомпрессии сообщения: {e}")
+            traceback.print_exc()
+            msg_text = None
+        texts.append(msg_text)
+    return texts
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+HISTORY_FIRST_PAGE_SQL = """
+    SELECT id, sender, receiver, timestamp, compressed_message
+    FROM private_messages
+    WHERE conversation_id = ?
+    ORDER BY id DESC
+    LIMIT ?
+"""
+HISTORY_PAGE_SQL = """
+    SELECT id, sender, receiver, timestamp, compressed_message
+    FROM private_messages
+    WHERE conversation_id = ? AND id < ?
+    ORDER BY id DESC
+    LIMIT ?
+"""
 
 @socketio.on('load_private_history')
 def handle_load_private_history(data):
+    # Постраничная загрузка: последние limit сообщений с id < before_id
+    # (без before_id - самые свежие). Клиент подгружает старые страницы при прокрутке вверх.
     room = data.get('room')
-    print(f"Загрузка истории для комнаты: {room}")
+    before_id = data.get('before_id')
+    try:
+        limit = min(max(int(data.get('limit') or HISTORY_PAGE_SIZE), 1), HISTORY_MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        limit = HISTORY_PAGE_SIZE
+    if before_id is not None:
+        try:
+            before_id = int(before_id)
+        except (TypeError, ValueError):
+            # Отвечаем пустой страницей без продолжения, иначе клиент
+            # так и останется в состоянии "история загружается"
+            print(f"Неверный before_id: {before_id!r}")
+            emit('load_private_history', {'room': room, 'before_id': before_id, 'messages': [],
+                                          'oldest_id': None, 'has_more': False})
+            return
+    print(f"Загрузка истории для комнаты: {room}, before_id={before_id}, limit={limit}")
     
     parts = room.split('_')
     if len(parts) != 2:
@@ -805,34 +1130,65 @@ def handle_load_private_history(data):
     c = conn.cursor()
     print(f"Запрос истории для пользователей {user1} и {user2}")
     
-    c.execute("""
-        SELECT sender, receiver, timestamp, compressed_message
-        FROM private_messages
-        WHERE (sender=? AND receiver=?) OR (sender=? AND receiver=?)
-        ORDER BY id ASC
-    """, (user1, user2, user2, user1))
+    # Берём на одну строку больше, чтобы узнать, есть ли ещё страницы
+    # Обе выборки идут по индексу (conversation_id, id) без сортировки
+    if before_id is None:
+        c.execute(HISTORY_FIRST_PAGE_SQL, (conversation_id(user1, user2), limit + 1))
+    else:
+        c.execute(HISTORY_PAGE_SQL, (conversation_id(user1, user2), before_id, limit + 1))
     
     rows = c.fetchall()
     conn.close()
+    has_more = len(rows) > limit
+    # Открытие чата (первая страница) - сообщения прочитаны
+    if before_id is None and session.get('username') in (user1, user2):
+        username = session['username']
+        mark_read(username, user2 if username == user1 else user1)
+    rows = rows[:limit][::-1]
     
     print(f"Найдено {len(rows)} сообщений в базе данных")
     
+    # Промахи кэша распаковываются одним вызовом run_blocking, а не по одному
+    texts = {row['id']: message_cache.get(row['id']) for row in rows}
+    missing = [row for row in rows if texts[row['id']] is None]
+    if missing:
+        decoded = run_blocking(decode_history, missing)
+        for row, msg_text in zip(missing, decoded):
+            texts[row['id']] = msg_text
+            if msg_text is not None:
+                message_cache.put(row['id'], msg_text)
+    
     messages = []
     for row in rows:
-        sender, receiver, timestamp, comp = row['sender'], row['receiver'], row['timestamp'], row['compressed_message']
-        try:
-            print(f"Декомпрессия сообщения от {sender} для {receiver}, размер: {len(comp)} байт")
-            msg_text = compression.decompress(comp).decode('utf-8', errors='replace')
-            print(f"Декомпрессированное сообщение: {msg_text[:50]}...")
-        except Exception as e:
-            print(f"Ошибка декомпрессии сообщения: {e}")
-            traceback.print_exc()
+        msg_text = texts[row['id']]
+        if msg_text is None:
             msg_text = "[Ошибка декомпрессии]"
-        
-        messages.append({'sender': sender, 'message': msg_text, 'timestamp': timestamp})
+        messages.append({'id': row['id'], 'sender': row['sender'], 'message': msg_text, 'timestamp': row['timestamp']})
     
     print(f"Отправляем {len(messages)} сообщений в комнату {room}")
-    emit('load_private_history', messages)
+    emit('load_private_history', {
+        'room': room,
+        'before_id': before_id,
+        'messages': messages,
+        'oldest_id': messages[0]['id'] if messages else None,
+        'has_more': has_more
+    })
+
+def mark_read(username, partner):
+    conn = get_db_connection()
+    conn.execute("UPDATE conversations SET unread_count = 0 WHERE user = ? AND partner = ? AND unread_count > 0",
+                 (username, partner))
+    conn.commit()
+    conn.close()
+
+@socketio.on('mark_read')
+def handle_mark_read(data):
+    # Клиент сообщает, что новое сообщение пришло в открытый чат
+    if 'username' not in session:
+        return
+    partner = data.get('partner')
+    if partner:
+        mark_read(session['username'], partner)
 
 @socketio.on('clear_chat')
 def handle_clear_chat(data):
@@ -874,6 +1230,52 @@ def compression_charts():
     
     return render_template('compression_charts.html')
 
+def round_ms(value):
+    return None if value is None else round(value, 3)
+
+def compression_data_point(row, algorithm, data_type):
+    # processingTime - измеренное время сжатия и распаковки (мс), cpuTime - процессорное;
+    # распаковка замеряется только у записей, попавших в выборочную проверку.
+    # У записей, сделанных до появления замеров, время неизвестно - None
+    compression_ratio = (row['original_size'] - row['compressed_size']) * 100.0 / row['original_size']
+    compress_ms = row['compress_ms']
+    processing_ms = cpu_ms = None
+    if compress_ms is not None:
+        processing_ms = compress_ms + (row['decompress_ms'] or 0.0)
+        cpu_ms = (row['compress_cpu_ms'] or 0.0) + (row['decompress_cpu_ms'] or 0.0)
+    return {
+        "algorithm": algorithm,
+        "dataType": data_type,
+        "dataSize": round(row['original_size'] / 1024, 2),  # КБ
+        "compressionRatio": round(float(compression_ratio), 2),
+        "processingTime": round_ms(processing_ms),
+        "cpuTime": round_ms(cpu_ms),
+        "compressTime": round_ms(compress_ms),
+        "decompressTime": round_ms(row['decompress_ms'])
+    }
+
+def measure_legacy_messages(rows):
+    # -> [(исходный размер, кодек, id)] для сообщений, которые удалось распаковать
+    updates = []
+    for row in rows:
+        comp = row['compressed_message']
+        try:
+            updates.append((len(compression.decompress(comp)), compression.frame_codec(comp), row['id']))
+        except Exception as e:
+            print(f"Ошибка декомпрессии сообщения {row['id']} при подсчёте размера: {e}")
+    return updates
+
+def backfill_message_sizes(conn):
+    # Сообщения, записанные до появления замеров: исходный размер и кодек
+    # восстанавливаются распаковкой один раз и сохраняются, время остаётся неизвестным
+    rows = conn.execute("SELECT id, compressed_message FROM private_messages WHERE original_size IS NULL").fetchall()
+    if not rows:
+        return
+    updates = run_blocking(measure_legacy_messages, rows)
+    conn.executemany("UPDATE private_messages SET original_size = ?, codec = ? WHERE id = ?", updates)
+    conn.commit()
+    print(f"Восстановлен исходный размер {len(updates)} старых сообщений")
+
 @app.route('/api/compression_data')
 def api_compression_data():
     if 'username' not in session:
@@ -882,17 +1284,17 @@ def api_compression_data():
     # Получаем данные из базы данных по файлам
     conn = get_db_connection()
     file_results = conn.execute("""
-        SELECT filename, original_size, compressed_size, compression_type, 
-               (original_size - compressed_size) * 100.0 / original_size as compression_ratio,
-               date_created
+        SELECT filename, original_size, compressed_size, compression_type,
+               compress_ms, compress_cpu_ms, decompress_ms, decompress_cpu_ms
         FROM file_stats
     """).fetchall()
     
-    # Получаем данные о сжатии сообщений
+    backfill_message_sizes(conn)
     msg_results = conn.execute("""
-        SELECT sender, receiver, length(compressed_message) as compressed_size, 
-               timestamp
+        SELECT original_size, length(compressed_message) as compressed_size, codec,
+               compress_ms, compress_cpu_ms, decompress_ms, decompress_cpu_ms
         FROM private_messages
+        WHERE original_size IS NOT NULL
     """).fetchall()
     conn.close()
     
@@ -917,44 +1319,21 @@ def api_compression_data():
         else:
             data_type = 'other'
         
-        # Расчет степени сжатия
-        compression_ratio = (row['original_size'] - row['compressed_size']) * 100.0 / row['original_size']
-        
-        # Расчет времени обработки на основе размера файла (эмуляция)
-        processing_time = int(row['original_size'] / 1024 * 5)  # 5 мс на каждый КБ данных (условно)
-        
-        data.append({
-            "algorithm": row['compression_type'],
-            "dataType": data_type,
-            "dataSize": round(row['original_size'] / 1024, 2),  # КБ
-            "compressionRatio": round(float(compression_ratio), 2),
-            "processingTime": processing_time
-        })
+        data.append(compression_data_point(row, row['compression_type'], data_type))
     
-    # Обработка данных по сообщениям
-    # Предполагаем, что среднее сообщение без сжатия занимает 2 байта на символ
-    # Это грубая оценка, так как мы не храним исходный размер сообщений
+    # Обработка данных по сообщениям: исходный размер и кодек записаны при отправке
     for msg in msg_results:
-        # Оцениваем исходный размер - для примера берем размер сжатого * 2.5
-        # В реальности вам нужно адаптировать эту логику под вашу систему
-        compressed_size = msg['compressed_size']
-        if compressed_size <= 0:
+        if msg['original_size'] <= 0 or msg['compressed_size'] <= 0:
             continue
-            
-        estimated_original_size = compressed_size * 2.5  # Очень грубая оценка
-        
-        if estimated_original_size > 0:
-            compression_ratio = ((estimated_original_size - compressed_size) / estimated_original_size) * 100
-            
-            data.append({
-                "algorithm": "bwt+mtf+rle+huffman",  # Предполагаем, что используется этот алгоритм
-                "dataType": "text",
-                "dataSize": round(estimated_original_size / 1024, 2),  # КБ
-                "compressionRatio": round(compression_ratio, 2),
-                "processingTime": int(estimated_original_size / 1024 * 3)  # 3 мс на КБ (условно)
-            })
+        data.append(compression_data_point(msg, msg['codec'], 'text'))
     
-    return jsonify({"data": data})
+    # verify - счётчики выборочной проверки записи (mismatches должно быть 0),
+    # cache - попадания и промахи кэша распакованных сообщений
+    return jsonify({"data": data, "verify": {
+        "rate": compression_service.verify_rate,
+        "checked": compression_service.stats['verified'],
+        "mismatches": compression_service.stats['mismatches']
+    }, "cache": message_cache.info()})
 
 @app.route('/api/reset_compression_data', methods=['POST'])
 def reset_compression_data():
@@ -963,9 +1342,15 @@ def reset_compression_data():
     conn = get_db_connection()
     conn.execute("DELETE FROM file_stats")
     conn.execute("DELETE FROM private_messages")
+    conn.execute("DELETE FROM conversations")
     conn.commit()
     conn.close()
+    message_cache.clear()
     return jsonify({"success": True})
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
\ No newline at end of file
+    # Продакшен: ASYNC_MODE=eventlet (или gevent) python server_flask.py
+    if ASYNC_MODE == 'threading':
+        socketio.run(app, debug=True)
+    else:
+        socketio.run(app, host=os.environ.get('HOST', '0.0.0.0'), port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file
@@ -0,0 +1,73 @@
+import sqlite3
+import threading
+import time
+
+import socketio
+
+########################################
+# Очередь сообщений Socket.IO поверх SQLite - локальная замена Redis
+# для запуска нескольких процессов сервера на одной машине и для тестов.
+# Каждый процесс пишет события (emit в комнату, вход в комнату и т.д.)
+# в таблицу pubsub и опрашивает её, пересылая чужие события своим
+# клиентам. URL: sqlite:///путь/к/файлу.db
+#
+# Для нескольких машин нужен настоящий брокер:
+# SOCKETIO_MESSAGE_QUEUE=redis://host:6379/0 (или amqp://... через kombu).
+########################################
+SQLITE_QUEUE_POLL = 0.02      # секунд между опросами таблицы
+SQLITE_QUEUE_RETENTION = 60   # сколько секунд хранить события
+
+class SQLiteManager(socketio.PubSubManager):
+    name = 'sqlite'
+
+    def __init__(self, url: str = 'sqlite:///socketio_queue.db', channel: str = 'flask-socketio',
+                 write_only: bool = False, logger=None, json=None,
+                 poll_interval: float = SQLITE_QUEUE_POLL, retention: float = SQLITE_QUEUE_RETENTION):
+        if not url.startswith('sqlite:///'):
+            raise ValueError(f"Ожидается URL вида sqlite:///путь, получено: {url}")
+        self.path = url[len('sqlite:///'):]
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.lock = threading.Lock()
+        self.conn = self.open_db()
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS pubsub (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT,
+                created REAL,
+                payload TEXT
+            )
+        ''')
+        self.conn.commit()
+        self.last_cleanup = time.time()
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+
+    def open_db(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _publish(self, data):
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT INTO pubsub (channel, created, payload) VALUES (?, ?, ?)",
+                              (self.channel, now, self.json.dumps(data)))
+            # Старые события удаляет тот, кто пишет, не чаще раза в retention
+            if now - self.last_cleanup > self.retention:
+                self.conn.execute("DELETE FROM pubsub WHERE created < ?", (now - self.retention,))
+                self.last_cleanup = now
+
+    def _listen(self):
+        # Отдельное соединение для опроса; начинаем с текущего конца таблицы,
+        # чтобы не переигрывать события, отправленные до запуска процесса
+        conn = self.open_db()
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM pubsub").fetchone()[0]
+        while True:
+            rows = conn.execute("SELECT id, payload FROM pubsub WHERE id > ? AND channel = ? ORDER BY id",
+                                (last_id, self.channel)).fetchall()
+            for message_id, payload in rows:
+                last_id = message_id
+                yield payload
+            self.server.sleep(self.poll_interval)
@@ -0,0 +1,333 @@
+import random
+
+import pytest
+
+import compression
+
+########################################
+# Регрессия формата хранения: сообщения в базе сжаты прошлыми версиями,
+# поэтому изменения кодеков не должны ломать ни BWT, ни старые кадры.
+# - bwt_transform сверяется с исходной сортировкой вращений
+#   (на периодических данных и данных с нулевыми байтами в том числе);
+# - кадры 0x00/0x01, снятые исходной версией compression.py, распаковываются;
+# - каждый кодек из available_codecs() проходит полный круг.
+# Запуск: python -m pytest test_compression.py
+########################################
+
+def rotation_sort_bwt(data: bytes) -> (bytes, int):
+    # Исходная реализация: все вращения строки с '\0' в конце, сортировка
+    s = data.decode('latin1') + '\0'
+    rotations = sorted(s[i:] + s[:i] for i in range(len(s)))
+    return ''.join(rot[-1] for rot in rotations).encode('latin1'), rotations.index(s)
+
+def random_bytes(size: int, alphabet: int = 256, seed: int = 0) -> bytes:
+    rng = random.Random(seed)
+    return bytes(rng.randrange(alphabet) for _ in range(size))
+
+BWT_INPUTS = [
+    b'',
+    b'a',
+    b'banana',
+    b'a' * 100,
+    b'ab' * 50,
+    b'abc' * 33 + b'ab',
+    b'\x00',
+    b'\x00' * 64,
+    b'a\x00' * 40,
+    b'\x00abc\x00abc\x00',
+    b'\xff\x00' * 30 + b'\xff',
+    'Привет, как дела? Привет!'.encode('utf-8'),
+    random_bytes(500, alphabet=2, seed=1),
+    random_bytes(500, alphabet=4, seed=2),
+    random_bytes(1000, seed=3),
+]
+
+@pytest.mark.parametrize('data', BWT_INPUTS)
+def test_bwt_matches_rotation_sort(data):
+    assert compression.bwt_transform(data) == rotation_sort_bwt(data)
+
+# (исходные данные, кадр исходной версии в hex): для каждого входа
+# сначала кадр 0x01 (с BWT), затем 0x00 (без BWT)
+LEGACY_FRAMES = [
+    (b'hello world',
+     '01040000000b0000006400010000006f00010000006d00010000006a0001000000040002000000720001000000690001'
+     '00000000000100000077000100000006000100000027000100000006eaf9c16836c0'),
+    (b'hello world',
+     '000b0000006800010000006600010000006c00010000000000010000006f000100000024000100000077000100000002'
+     '00010000007300010000000400010000006a000100000001acb9a79a1e'),
+    ('Привет, как дела?'.encode('utf-8'),
+     '0112000000130000003f0001000000ba00020000002e0001000000830001000000b10001000000d10002000000000002'
+     '0000000001010000000a0002000000070002000000bd0001000000bc0001000000290001000000b90001000000b80001'
+     '000000890001000000040001000000a8000100000001000100000002d1dc23d3cb381056ccffcb9f50'),
+    ('Привет, как дела?'.encode('utf-8'),
+     '0015000000d00001000000a00001000000d10001000000830001000000030002000000ba0001000000010007000000b5'
+     '0001000000b80001000000050002000000880001000000340001000000290001000000bc0001000000b6000100000002'
+     '0002000000b90001000000080001000000bd00010000000600010000004b00010000000627ca6aca09c79280e9db757e'
+     '66c5ee00'),
+    (b'abababababababababababababababababababababababababababababababab',
+     '0120000000050000006200020000000001020000000000020000001f0002000000010001000000038ee8e8'),
+    (b'abababababababababababababababababababababababababababababababab',
+     '00050000006100010000006200010000000001010000000100010000003e000100000004d740'),
+    (b'a\x00b\x00\x00a\x00b\x00\x00a\x00b\x00\x00a\x00b\x00\x00a\x00b\x00\x00',
+     '011400000007000000620002000000000104000000000004000000040002000000010002000000050001000000090001'
+     '0000000651bc328de1c0'),
+    (b'a\x00b\x00\x00a\x00b\x00\x00a\x00b\x00\x00a\x00b\x00\x00a\x00b\x00\x00',
+     '000500000061000100000001000a0000006200010000000000050000000200080000000784aed76bb5da80'),
+    (b'ERROR line 42: timeout\nERROR line 42: timeout\nERROR line 42: timeout\n',
+     '0118000000180000000a000200000074000100000000002a0000006600010000005400010000003d0001000000380001'
+     '000000250001000000370001000000070001000000080001000000060001000000520001000000010001000000490001'
+     '0000006f00030000000c00010000006d00010000000001010000000500010000000e0001000000750001000000030001'
+     '0000007100010000000712b73772f636b6f7ef07434b673cf2678eaa95d1c1a7ad80'),
+    (b'ERROR line 42: timeout\nERROR line 42: timeout\nERROR line 42: timeout\n',
+     '001b0000004500010000005200010000000000030000005000010000000100030000002300010000006c00010000006a'
+     '00010000006e00010000006800010000000400030000003b00010000003a000100000041000100000003000300000074'
+     '00010000000700060000006f00010000007000010000007500010000000500030000001900010000000f00160000000e'
+     '00020000000a00020000000b00040000000c000200000007810b3010bd43288cd3bf5a4a6526eed72b611d751feae39f'
+     'bfcad8475d47fab8e7ef80'),
+]
+
+@pytest.mark.parametrize('data, frame', LEGACY_FRAMES)
+def test_legacy_frames_decode(data, frame):
+    frame = bytes.fromhex(frame)
+    assert frame[0] in (0x00, 0x01)
+    assert compression.decompress(frame) == data
+
+ROUNDTRIP_INPUTS = {
+    'empty': b'',
+    'byte': b'x',
+    'chat': 'Привет! Встретимся завтра в 10:00 у входа. ok, see you later'.encode('utf-8'),
+    'log': b''.join(b'2024-05-01 12:00:%02d ERROR worker %d: timeout\n' % (i % 60, i % 7) for i in range(200)),
+    'runs': b'\x00' * 5000 + b'a' * 3000,
+    'random': random_bytes(3000, seed=4),
+}
+
+@pytest.mark.parametrize('codec', compression.available_codecs() + ('auto',))
+@pytest.mark.parametrize('kind', list(ROUNDTRIP_INPUTS))
+def test_codec_roundtrip(codec, kind):
+    data = ROUNDTRIP_INPUTS[kind]
+    frame = compression.compress(data, codec=codec)
+    assert compression.decompress(frame) == data
+    assert bytes(compression.decompress_view(frame)) == data
+
+########################################
+# Обратное BWT через LF-отображение (inverse_bwt): результат сверяется
+# с восстановлением по таблице вращений, как это делала исходная версия
+########################################
+def rotation_table_inverse(last_column: bytes, index: int) -> bytes:
+    # n раз приписываем последний столбец слева и сортируем строки таблицы
+    column = last_column.decode('latin1')
+    table = [''] * len(column)
+    for _ in range(len(column)):
+        table = sorted(c + row for c, row in zip(column, table))
+    return table[index][:-1].encode('latin1')
+
+@pytest.mark.parametrize('data', BWT_INPUTS)
+def test_inverse_bwt_roundtrip(data):
+    assert compression.inverse_bwt(*compression.bwt_transform(data)) == data
+
+@pytest.mark.parametrize('data', [data for data in BWT_INPUTS if 0 < len(data) <= 200])
+def test_inverse_bwt_matches_rotation_table(data):
+    last_column, index = compression.bwt_transform(data)
+    assert compression.inverse_bwt(last_column, index) == rotation_table_inverse(last_column, index)
+
+def test_inverse_bwt_large_input():
+    data = ROUNDTRIP_INPUTS['log'] * 8
+    assert compression.inverse_bwt(*compression.bwt_transform(data)) == data
+
+########################################
+# Блочный контейнер 0x02: каждый блок - самостоятельный кадр,
+# который распаковывается без соседних, в том числе в пуле процессов
+########################################
+def container_frames(frame: bytes) -> list[bytes]:
+    body = frame[1:]
+    frames = []
+    offset = 0
+    while True:
+        length = int.from_bytes(body[offset:offset+4], 'little')
+        offset += 4
+        if length == 0:
+            return frames
+        frames.append(body[offset:offset+length])
+        offset += length
+
+@pytest.mark.parametrize('use_bwt', [True, False])
+def test_block_container_roundtrip(use_bwt):
+    data = ROUNDTRIP_INPUTS['log'] * 3
+    frame = compression.compress(data, use_bwt=use_bwt, block_size=4096)
+    assert frame[0] == compression.FLAG_BLOCKS
+    assert compression.decompress(frame) == data
+
+def test_blocks_decode_independently():
+    data = ROUNDTRIP_INPUTS['log'] * 3
+    frame = compression.compress(data, block_size=4096)
+    blocks = compression.split_blocks(data, 4096)
+    frames = container_frames(frame)
+    assert len(frames) == len(blocks)
+    for block, block_frame in zip(blocks, frames):
+        assert compression.decompress(block_frame) == block
+
+@pytest.mark.parametrize('size', [4095, 4096, 4097, 3 * 4096])
+def test_block_boundaries(size):
+    data = (ROUNDTRIP_INPUTS['log'] * 2)[:size]
+    frame = compression.compress(data, block_size=4096)
+    assert compression.decompress(frame) == data
+
+def test_parallel_block_decode_matches_serial():
+    data = ROUNDTRIP_INPUTS['log'] * 3
+    frame = compression.compress(data, block_size=4096, workers=2)
+    assert compression.decompress(frame, workers=2) == compression.decompress(frame) == data
+
+########################################
+# Формат v2 (0x03/0x04): канонические длины кодов вместо таблицы частот
+########################################
+def fibonacci_frequencies(count: int) -> dict:
+    # Частоты Фибоначчи дают самое глубокое дерево Хаффмана
+    freq = {}
+    a, b = 1, 1
+    for symbol in range(count):
+        freq[symbol] = a
+        a, b = b, a + b
+    return freq
+
+def test_code_lengths_are_limited():
+    lengths = compression.huffman_code_lengths(fibonacci_frequencies(30))
+    assert max(lengths.values()) <= compression.MAX_CODE_LENGTH
+    # Неравенство Крафта: для таких длин префиксный код существует
+    assert sum(2 ** -length for length in lengths.values()) <= 1
+
+def test_canonical_codes_are_prefix_free():
+    freq = compression.build_frequency_table(list(ROUNDTRIP_INPUTS['log']))
+    codes = compression.canonical_codes(compression.huffman_code_lengths(freq))
+    words = sorted(format(code, f'0{length}b') for code, length in codes.values())
+    assert all(not b.startswith(a) for a, b in zip(words, words[1:]))
+
+def test_code_lengths_header_roundtrip():
+    freq = compression.build_frequency_table(list(random_bytes(2000, seed=5)) + [compression.RLE_MARKER])
+    lengths = compression.huffman_code_lengths(freq)
+    packed = compression.pack_code_lengths(lengths)
+    assert compression.unpack_code_lengths(b'xx' + packed, 2) == (lengths, 2 + len(packed))
+
+def test_v2_header_smaller_than_frequency_table():
+    symbols = compression.rle_encode(compression.mtf_encode(ROUNDTRIP_INPUTS['chat']))
+    freq = compression.build_frequency_table(symbols)
+    lengths = compression.huffman_code_lengths(freq)
+    assert len(compression.pack_code_lengths(lengths)) < len(compression.pack_frequency_table(freq))
+
+@pytest.mark.parametrize('codec, flag', [('bwt', compression.FLAG_SMALL_V2), ('large', compression.FLAG_LARGE_V2)])
+def test_v2_frames(codec, flag):
+    data = ROUNDTRIP_INPUTS['log']
+    frame = compression.compress(data, codec=codec)
+    assert frame[0] == flag
+    assert compression.decompress(frame) == data
+
+########################################
+# Автовыбор кодека (codec='auto'): решение choose_codec() по выборке
+# и флаг кадра, который в итоге записал compress()
+########################################
+AUTO_CASES = [
+    ('random', random_bytes(8192, seed=6), 'stored'),
+    ('log-1k', ROUNDTRIP_INPUTS['log'][:1024], 'zlib'),
+    ('log-8k', (ROUNDTRIP_INPUTS['log'] * 3)[:8192], 'bwt'),
+    ('log-large', ROUNDTRIP_INPUTS['log'] * 30, compression.preferred_codec()),
+]
+
+@pytest.mark.parametrize('name, data, codec', AUTO_CASES, ids=[case[0] for case in AUTO_CASES])
+def test_choose_codec(name, data, codec):
+    assert compression.choose_codec(data) == codec
+    frame = compression.compress(data, codec='auto')
+    assert compression.frame_codec(frame) == codec
+    assert compression.decompress(frame) == data
+
+def test_sample_payload_covers_start_middle_end():
+    data = bytes(range(256)) * 100
+    sample = compression.sample_payload(data, 1024)
+    assert len(sample) == 3 * 1024
+    assert sample[:1024] == data[:1024] and sample[-1024:] == data[-1024:]
+    assert compression.sample_payload(data[:2048], 1024) == data[:2048]
+
+@pytest.mark.parametrize('kind', list(ROUNDTRIP_INPUTS))
+def test_auto_frame_never_larger_than_stored(kind):
+    data = ROUNDTRIP_INPUTS[kind]
+    assert len(compression.compress(data, codec='auto')) <= len(data) + 1
+
+########################################
+# Кадр без сжатия 0x05: для крошечных сообщений и там, где сжатие
+# не выиграло; на байт длиннее входа и распаковывается без копии
+########################################
+@pytest.mark.parametrize('data', [b'', b'ok', 'да'.encode('utf-8'), b'+1'])
+def test_tiny_messages_are_stored(data):
+    frame = compression.compress(data, codec='auto')
+    assert frame == bytes([compression.FLAG_STORED]) + data
+    assert compression.frame_codec(frame) == 'stored'
+
+@pytest.mark.parametrize('codec', ['bwt', 'large', 'zlib'])
+def test_incompressible_data_falls_back_to_stored(codec):
+    data = random_bytes(2000, seed=7)
+    frame = compression.compress(data, codec=codec)
+    assert frame[0] == compression.FLAG_STORED
+    assert len(frame) == len(data) + 1
+
+def test_stored_frame_decodes_without_copy():
+    frame = compression.compress(b'hello', codec='stored')
+    view = compression.decompress_view(frame)
+    assert view.obj is frame
+    assert bytes(view) == b'hello'
+
+########################################
+# Статические модели (0x07): модель из models/ загружается при импорте,
+# кадр хранит только её ID, обучение и загрузка дают тот же код
+########################################
+def test_bundled_model_is_loaded():
+    assert compression.default_model_id() in compression.STATIC_MODELS
+
+def test_model_frame_for_short_chat():
+    data = ROUNDTRIP_INPUTS['chat']
+    codec, frame = compression.compress_short(data)
+    assert codec == 'model' and frame[0] == compression.FLAG_MODEL
+    assert len(frame) < len(compression.compress(data, codec='zlib'))
+    assert compression.decompress(frame) == data
+
+def test_trained_model_roundtrip(tmp_path, monkeypatch):
+    monkeypatch.setattr(compression, 'STATIC_MODELS', dict(compression.STATIC_MODELS))
+    samples = [ROUNDTRIP_INPUTS['chat'], ROUNDTRIP_INPUTS['log'][:500]]
+    lengths = compression.train_static_model(samples)
+    compression.save_static_model(str(tmp_path / 'test_200.json'), 200, lengths)
+    compression.load_static_models(str(tmp_path))
+    assert compression.STATIC_MODELS[200]['lengths'] == lengths
+    data = ROUNDTRIP_INPUTS['log'][:300]
+    frame = compression.compress(data, codec='model')
+    assert frame[0] == compression.FLAG_MODEL
+    assert compression.decode_varint(frame, 1)[0] == 200
+    assert compression.decompress(frame) == data
+
+def test_unknown_model_is_rejected():
+    frame = bytes([compression.FLAG_MODEL]) + compression.encode_varint(99) + compression.encode_varint(0) + b'\x00'
+    with pytest.raises(ValueError, match='99'):
+        compression.decompress(frame)
+
+########################################
+# Внешние кодеки (zstd/lz4/brotli/lzma): регистрируются, только если
+# модуль установлен; без модуля compress() откатывается на zlib,
+# а decompress() называет недостающий модуль
+########################################
+EXTERNAL_CODECS = [name for name in compression.OPTIONAL_CODECS if name in compression.CODEC_REGISTRY]
+
+@pytest.mark.parametrize('name', EXTERNAL_CODECS)
+def test_external_codec_frames(name):
+    data = ROUNDTRIP_INPUTS['log']
+    frame = compression.compress(data, codec=name)
+    assert frame[0] == compression.OPTIONAL_CODECS[name][0]
+    assert compression.frame_codec(frame) == name
+    assert compression.decompress(frame) == data
+
+@pytest.mark.parametrize('name', list(compression.OPTIONAL_CODECS))
+def test_missing_external_codec(name, monkeypatch):
+    flag, module = compression.OPTIONAL_CODECS[name]
+    monkeypatch.delitem(compression.CODEC_REGISTRY, name, raising=False)
+    monkeypatch.delitem(compression.FLAG_CODECS, flag, raising=False)
+    data = ROUNDTRIP_INPUTS['log']
+    frame = compression.compress(data, codec=name)
+    assert frame[0] == compression.FLAG_ZLIB
+    assert compression.decompress(frame) == data
+    with pytest.raises(ValueError, match=module):
+        compression.decompress(bytes([flag]) + b'\x00' * 8)
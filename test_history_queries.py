@@ -0,0 +1,67 @@
+import importlib
+import sqlite3
+
+import pytest
+
+########################################
+# Планы запросов истории и очистки чата: на базе, созданной init_db,
+# они должны идти по индексу (conversation_id, id) без сортировки
+# во временном B-дереве.
+# Запуск: python -m pytest test_history_queries.py
+########################################
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # server_flask при импорте создаёт database.db в текущем каталоге
+    monkeypatch.chdir(tmp_path)
+    server = importlib.import_module('server_flask')
+    monkeypatch.setattr(server, 'DATABASE', str(tmp_path / 'plans.db'))
+    server.init_db()
+    conn = sqlite3.connect(server.DATABASE)
+    yield server, conn
+    conn.close()
+
+def query_plan(conn, sql: str, params: tuple) -> list[str]:
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+def test_history_page_uses_conversation_index(db):
+    server, conn = db
+    plan = query_plan(conn, server.HISTORY_PAGE_SQL, (server.conversation_id('alice', 'bob'), 100, 51))
+    assert any(step.startswith('SEARCH private_messages')
+               and 'idx_private_messages_conversation (conversation_id=? AND id<?)' in step for step in plan), plan
+    assert not any('USE TEMP B-TREE' in step for step in plan), plan
+
+def test_history_first_page_uses_conversation_index(db):
+    server, conn = db
+    plan = query_plan(conn, server.HISTORY_FIRST_PAGE_SQL, (server.conversation_id('alice', 'bob'), 51))
+    assert any('idx_private_messages_conversation (conversation_id=?)' in step for step in plan), plan
+    assert not any('USE TEMP B-TREE' in step for step in plan), plan
+
+def test_clear_chat_uses_conversation_index(db):
+    server, conn = db
+    plan = query_plan(conn, server.CLEAR_CHAT_SQL, (server.conversation_id('alice', 'bob'),))
+    assert any(step.startswith('SEARCH private_messages')
+               and 'idx_private_messages_conversation (conversation_id=?)' in step for step in plan), plan
+
+def test_conversation_id_pairs_do_not_collide(tmp_path, monkeypatch):
+    # Пары, которые при старом ключе "a\x1fb" совпадали, и не-ASCII имена:
+    # миграция старой базы должна дать тот же ключ, что и conversation_id()
+    monkeypatch.chdir(tmp_path)
+    server = importlib.import_module('server_flask')
+    monkeypatch.setattr(server, 'DATABASE', str(tmp_path / 'old.db'))
+    pairs = [('a\x1fb', 'c'), ('a', 'b\x1fc'), ('ёжик', 'Боб'), ('Боб', 'ёжик')]
+    conn = sqlite3.connect(server.DATABASE)
+    conn.execute("CREATE TABLE private_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, sender TEXT, "
+                 "receiver TEXT, timestamp REAL, compressed_message BLOB, conversation_id TEXT)")
+    conn.executemany("INSERT INTO private_messages (sender, receiver, conversation_id) VALUES (?, ?, ?)",
+                     [(a, b, '\x1f'.join(sorted((a, b)))) for a, b in pairs])
+    conn.commit()
+    conn.close()
+    server.init_db()
+    conn = sqlite3.connect(server.DATABASE)
+    rows = conn.execute("SELECT sender, receiver, conversation_id FROM private_messages ORDER BY id").fetchall()
+    conn.close()
+    for sender, receiver, key in rows:
+        assert key == server.conversation_id(sender, receiver)
+    assert len({key for _, _, key in rows}) == 3
+    assert not server.valid_username('a\x1fb')
@@ -0,0 +1,89 @@
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+
+########################################
+# Устойчивость MessageWriter к падению процесса: дочерний процесс пишет
+# сообщения из нескольких потоков и печатает id каждого подтверждённого,
+# тест убивает его SIGKILL посреди потока записей и открывает базу заново.
+# Каждый подтверждённый id должен быть на месте, а каждое сообщение -
+# целиком: с правильным содержимым и со строкой followup из той же транзакции.
+# Запуск: python -m pytest test_message_writer.py
+########################################
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+SCHEMA = '''
+    CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, seq INTEGER, payload BLOB);
+    CREATE TABLE receipts (seq INTEGER PRIMARY KEY, size INTEGER);
+'''
+
+WRITER_SCRIPT = '''
+import sqlite3, sys, threading
+from message_writer import MessageWriter
+
+database, threads = sys.argv[1], int(sys.argv[2])
+
+def connect():
+    conn = sqlite3.connect(database, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+writer = MessageWriter(connect, "INSERT INTO messages (seq, payload) VALUES (?, ?)",
+                       followups=("INSERT INTO receipts (seq, size) VALUES (?, ?)",))
+lock = threading.Lock()
+
+def worker(start):
+    seq = start
+    while True:
+        payload = bytes([seq % 251]) * (100 + seq % 900)
+        message_id = writer.write((seq, payload), ([(seq, len(payload))],))
+        with lock:
+            print(message_id, seq, flush=True)
+        seq += threads
+
+for start in range(threads):
+    threading.Thread(target=worker, args=(start,)).start()
+'''
+
+def test_acknowledged_messages_survive_kill(tmp_path):
+    database = str(tmp_path / 'crash.db')
+    conn = sqlite3.connect(database)
+    conn.executescript(SCHEMA)
+    conn.close()
+
+    child = subprocess.Popen([sys.executable, '-c', WRITER_SCRIPT, database, '8'],
+                             cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    acked = {}
+    deadline = time.monotonic() + 30
+    try:
+        while len(acked) < 2000 and time.monotonic() < deadline:
+            line = child.stdout.readline()
+            if not line:
+                break
+            message_id, seq = map(int, line.split())
+            acked[message_id] = seq
+    finally:
+        os.kill(child.pid, signal.SIGKILL)
+        child.wait()
+        child.stdout.close()
+    assert len(acked) >= 100, "писатель не успел подтвердить сообщения до остановки"
+
+    conn = sqlite3.connect(database)
+    assert conn.execute("PRAGMA integrity_check").fetchone()[0] == 'ok'
+    rows = {message_id: (seq, payload) for message_id, seq, payload
+            in conn.execute("SELECT id, seq, payload FROM messages")}
+    receipts = dict(conn.execute("SELECT seq, size FROM receipts"))
+    conn.close()
+
+    # Все подтверждённые id на месте и принадлежат своим сообщениям
+    for message_id, seq in acked.items():
+        assert message_id in rows, f"подтверждённое сообщение {message_id} потеряно"
+        assert rows[message_id][0] == seq
+    # Ничего не записано наполовину: содержимое целое, followup той же транзакции есть
+    for seq, payload in rows.values():
+        assert payload == bytes([seq % 251]) * (100 + seq % 900)
+        assert receipts.get(seq) == len(payload)
+    assert len(receipts) == len(rows)
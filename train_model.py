@@ -0,0 +1,50 @@
+import argparse
+import os
+import sqlite3
+
+import compression
+
+########################################
+# Обучение статической модели сжатия на корпусе private_messages.
+# Модель сохраняется в models/chat_<id>.json и подхватывается
+# compression.py при импорте. ID модели пишется в каждый кадр 0x07,
+# поэтому однажды выпущенную модель нельзя менять - только добавлять
+# новую с новым ID.
+########################################
+
+def load_corpus(database: str, limit: int = None) -> list[bytes]:
+    conn = sqlite3.connect(database)
+    query = "SELECT compressed_message FROM private_messages ORDER BY id DESC"
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    samples = []
+    for (comp,) in conn.execute(query):
+        try:
+            samples.append(compression.decompress(comp))
+        except Exception as e:
+            print(f"Пропускаем сообщение, которое не удалось распаковать: {e}")
+    conn.close()
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description="Обучение статической модели сжатия сообщений")
+    parser.add_argument("--db", default="database.db", help="Путь к базе данных")
+    parser.add_argument("--id", type=int, required=True, help="ID новой модели (1-127)")
+    parser.add_argument("--limit", type=int, help="Сколько последних сообщений взять")
+    parser.add_argument("--out-dir", default=compression.MODELS_DIR, help="Каталог моделей")
+    args = parser.parse_args()
+
+    if args.id in compression.STATIC_MODELS:
+        parser.error(f"Модель с ID {args.id} уже существует")
+
+    samples = load_corpus(args.db, args.limit)
+    print(f"Сообщений в корпусе: {len(samples)}, байт: {sum(len(s) for s in samples)}")
+    lengths = compression.train_static_model(samples)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    path = os.path.join(args.out_dir, f"chat_{args.id}.json")
+    compression.save_static_model(path, args.id, lengths)
+    print(f"Модель сохранена: {path} ({len(lengths)} символов)")
+
+if __name__ == '__main__':
+    main()